@@ -0,0 +1,154 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from config import DB_PATH, ANALYTICS_PROCESSES, ANALYTICS_TASK_TIMEOUT, ANALYTICS_MAX_PENDING
+import database
+from database import ConnectionPool, run_db
+
+# SQLiteが進捗ハンドラで期限を確認する間隔（仮想マシン命令数）
+PROGRESS_CHECK_STEPS = 10000
+
+def _init_worker() -> None:
+    """ワーカープロセスごとに読み取り専用接続を1本だけ持つ"""
+    database.db_pool = ConnectionPool(DB_PATH, max_size=1, readonly=True)
+
+def _run_task(func: Callable[..., Any], args: Tuple[Any, ...], deadline: float) -> Tuple[bool, Any]:
+    """ワーカープロセスで集計を実行し (成功, 結果) を返す
+
+    HTTPException はpickleできないため (ステータス, 詳細) にして返す。
+    期限を過ぎたら実行中のSQLを中断し、タイムアウトとして返す。
+    """
+    if time.time() >= deadline:
+        return False, None
+    pool = database.db_pool
+    # 集計関数はプールの唯一の接続を使うため、ここで期限を設定しておく
+    with pool.connection() as conn:
+        conn.set_progress_handler(lambda: time.time() >= deadline, PROGRESS_CHECK_STEPS)
+    try:
+        return True, func(*args)
+    except HTTPException as e:
+        if time.time() >= deadline:
+            return False, None
+        return False, (e.status_code, e.detail)
+    finally:
+        with pool.connection() as conn:
+            conn.set_progress_handler(None, 0)
+
+class AnalyticsExecutor:
+    """重い分析集計を別プロセスで実行する
+
+    イベントループ（リダイレクトを処理するスレッド）とGILを共有しないため、
+    大きなキャンペーンの集計中もリダイレクトの応答時間が変わらない。
+    各プロセスは起動時に自前の読み取り専用接続を開く。実行待ちと実行中の
+    合計が max_pending に達したら 503、timeout 秒を過ぎたら 504 を返す。
+    processes=0 の場合は従来どおり分析用DBスレッドで実行する（制限なし）。
+    """
+
+    def __init__(self, processes: int, timeout: float = 30.0, max_pending: int = 32):
+        self.processes = processes
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.pool_restarts = 0
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """func(*args) を実行（func と引数・戻り値はpickle可能なこと）"""
+        pool = self._get_pool()
+        if pool is None:
+            return await run_db("analytics", func, *args)
+
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Analytics is busy, please retry later",
+                                    headers={"Retry-After": "5"})
+            self.pending += 1
+
+        deadline = time.time() + self.timeout
+        try:
+            future = pool.submit(_run_task, func, args, deadline)
+        except BrokenProcessPool as e:
+            self._finish(None)
+            return await self._run_in_thread(pool, e, func, args)
+        # タイムアウト後もワーカーが中断するまでは実行中として数える
+        future.add_done_callback(self._finish)
+
+        try:
+            ok, result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HTTPException(status_code=504, detail="Analytics timed out")
+        except BrokenProcessPool as e:
+            return await self._run_in_thread(pool, e, func, args)
+
+        if ok:
+            return result
+        if result is None:
+            self.timeouts += 1
+            raise HTTPException(status_code=504, detail="Analytics timed out")
+        status_code, detail = result
+        raise HTTPException(status_code=status_code, detail=detail)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processes": self.processes,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "timeout": self.timeout,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "pool_restarts": self.pool_restarts
+        }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.processes <= 0:
+            return None
+        with self._lock:
+            if self._pool is None:
+                # スレッドを持つ親プロセスからforkしないよう spawn を使う
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker
+                )
+            return self._pool
+
+    def _finish(self, future: Optional[Future]) -> None:
+        with self._lock:
+            self.pending -= 1
+            if future is not None and not future.cancelled():
+                self.completed += 1
+
+    async def _run_in_thread(self, pool: ProcessPoolExecutor, error: Exception,
+                             func: Callable[..., Any], args: Tuple[Any, ...]) -> Any:
+        """プールが壊れたら作り直しを予約し、今回はスレッドで実行する"""
+        print(f"⚠️  Analytics process pool broken, running in-process: {error}")
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self.pool_restarts += 1
+        return await run_db("analytics", func, *args)
+
+analytics_executor = AnalyticsExecutor(
+    processes=ANALYTICS_PROCESSES,
+    timeout=ANALYTICS_TASK_TIMEOUT,
+    max_pending=ANALYTICS_MAX_PENDING
+)
@@ -0,0 +1,98 @@
+import sqlite3
+from datetime import datetime, timezone
+from typing import List, Optional, Set, Tuple
+from models import BulkGenerationItem
+from code_allocator import code_allocator
+from utils import generate_short_code
+
+# 生成コードの衝突時の最大試行回数
+MAX_CODE_ATTEMPTS = 5
+
+# IN句1回あたりのプレースホルダ数（SQLiteの変数上限より小さく）
+SQL_IN_CHUNK_SIZE = 500
+
+INSERT_URL_SQL = (
+    "INSERT INTO urls (short_code, original_url, custom_name, campaign_name, created_by, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+def existing_short_codes(conn: sqlite3.Connection, codes: List[str]) -> Set[str]:
+    """登録済みのコードを集合クエリでまとめて取得"""
+    existing: Set[str] = set()
+    for i in range(0, len(codes), SQL_IN_CHUNK_SIZE):
+        chunk = codes[i:i + SQL_IN_CHUNK_SIZE]
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = conn.execute(f"SELECT short_code FROM urls WHERE short_code IN ({placeholders})", chunk)
+        existing.update(row[0] for row in rows)
+    return existing
+
+def insert_bulk_items(conn: sqlite3.Connection, items: List[BulkGenerationItem],
+                      created_by: str = 'bulk_api') -> Tuple[str, List[Tuple[Optional[str], Optional[str]]]]:
+    """URLを一括登録（ライタースレッドで実行）
+
+    カスタムスラッグは1回の集合クエリで検証し、生成コードは先にまとめて
+    割り当ててから executemany で一括INSERTする。一括INSERTが失敗した
+    場合のみ1行ずつのセーブポイントでやり直し、失敗した行だけをエラーにする。
+
+    戻り値は (作成時刻, 各itemの (short_code, error))。
+    """
+    errors = {}
+    
+    # カスタムスラッグのチェック（既存・リクエスト内の重複）
+    slugs = [item.custom_slug for item in items if item.custom_slug]
+    existing = existing_short_codes(conn, list(set(slugs)))
+    seen: Set[str] = set()
+    for index, item in enumerate(items):
+        slug = item.custom_slug
+        if not slug:
+            continue
+        if slug in existing:
+            errors[index] = f"Custom slug '{slug}' already exists"
+        elif slug in seen:
+            errors[index] = f"Custom slug '{slug}' is duplicated in this request"
+        seen.add(slug)
+    
+    # 生成コードはリースからまとめて割り当てる
+    pending = [index for index in range(len(items)) if index not in errors]
+    codes = iter(code_allocator.allocate(conn, sum(1 for index in pending if not items[index].custom_slug)))
+    short_codes = {index: items[index].custom_slug or next(codes) for index in pending}
+    
+    # CURRENT_TIMESTAMP と同じ形式（UTC）で作成時刻を決めておき、読み戻しを省く
+    created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    
+    def row(index: int) -> tuple:
+        item = items[index]
+        return (short_codes[index], item.original_url, item.custom_name, item.campaign_name, created_by, created_at)
+    
+    conn.execute("SAVEPOINT bulk_insert")
+    try:
+        conn.executemany(INSERT_URL_SQL, [row(index) for index in pending])
+        conn.execute("RELEASE bulk_insert")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK TO bulk_insert")
+        conn.execute("RELEASE bulk_insert")
+        
+        # 1行ずつ登録し、失敗した行だけをエラーにする
+        for index in pending:
+            item = items[index]
+            for attempt in range(MAX_CODE_ATTEMPTS):
+                conn.execute("SAVEPOINT bulk_row")
+                try:
+                    conn.execute(INSERT_URL_SQL, row(index))
+                    conn.execute("RELEASE bulk_row")
+                    break
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO bulk_row")
+                    conn.execute("RELEASE bulk_row")
+                    # 生成コードが旧方式のコード等と衝突した場合のみ次のコードで再試行
+                    if (item.custom_slug or attempt == MAX_CODE_ATTEMPTS - 1
+                            or not isinstance(e, sqlite3.IntegrityError)):
+                        errors[index] = str(e)
+                        break
+                    short_codes[index] = generate_short_code(conn=conn)
+    
+    outcomes = [
+        (None, errors[index]) if index in errors else (short_codes[index], None)
+        for index in range(len(items))
+    ]
+    return created_at, outcomes
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+from config import (
+    URL_CACHE_SIZE, URL_CACHE_TTL, URL_MISS_CACHE_SIZE, URL_MISS_CACHE_TTL, ANALYTICS_CACHE_TTL, ANALYTICS_CACHE_MAX_STALE,
+    ANALYTICS_CACHE_ENTRIES, ANALYTICS_CACHE_BYTES, ANALYTICS_CACHE_SERVE_STALE
+)
+
+class LRUCache:
+    """サイズ上限・TTL付きのスレッドセーフなLRUキャッシュ
+
+    max_bytes を指定すると sizeof(value) の合計もその範囲に収める。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Callable[[Any], int] = len):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """値を取得（期限切れは削除してミス扱い）"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """値を保存（上限超過時は最も古いエントリを追い出す）"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        size = self.sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return  # 単体で予算を超える値は保存しない
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """指定キーを無効化"""
+        with self._lock:
+            return self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key: Hashable) -> bool:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[2]
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット/ミス統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+def _estimate_size(value: Any) -> int:
+    """キャッシュする値のおおよそのバイト数（レスポンスは本文、それ以外はJSON換算）"""
+    body = getattr(value, 'body', value)
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return len(json.dumps(body, ensure_ascii=False, default=str))
+
+class UrlCache:
+    """短縮コード解決キャッシュ（値は (url_id, original_url, is_active)）
+
+    存在しないコードの (None, None, False) は別のLRUに短いTTLで保存する。
+    作成時の無効化は作成したワーカーにしか届かないため、他ワーカーでも
+    miss_ttl 秒で新しいコードが見えるようにし、また大量の存在しないコードで
+    有効なエントリが追い出されないよう件数の上限も分ける。
+    """
+
+    def __init__(self, max_entries: int, ttl: Optional[float], miss_entries: int, miss_ttl: float):
+        self._found = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._missing = LRUCache(max_entries=miss_entries, ttl=miss_ttl) if miss_ttl > 0 else None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._found.get(key)
+        if value is None and self._missing is not None:
+            value = self._missing.get(key)
+        return default if value is None else value
+
+    def set(self, key: Hashable, value: tuple) -> None:
+        if value[0] is None:
+            self._found.invalidate(key)
+            if self._missing is not None:
+                self._missing.set(key, value)
+        else:
+            if self._missing is not None:
+                self._missing.invalidate(key)
+            self._found.set(key, value)
+
+    def invalidate(self, key: Hashable) -> bool:
+        found = self._found.invalidate(key)
+        missing = self._missing.invalidate(key) if self._missing is not None else False
+        return found or missing
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._found.stats(),
+            "missing": self._missing.stats() if self._missing is not None else None
+        }
+
+class AnalyticsCache:
+    """分析レスポンスのキャッシュ（キーは (short_code, view, range)）
+
+    エントリには計算を始めた時点のURLごとの世代番号を持たせ、クリックの
+    取り込みで世代が進むか、TTLを過ぎたら古いとみなす。serve_stale が
+    有効なら古いエントリをそのまま返してバックグラウンドで再計算し、
+    max_stale 秒を過ぎたエントリは破棄する。
+
+    世代を進めるのは同じプロセスのクリックライターのため、複数ワーカー
+    構成では他ワーカーが記録したクリックはTTLの経過でのみ反映される。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 30.0, max_stale: float = 300.0,
+                 max_bytes: Optional[int] = None, serve_stale: bool = True):
+        self.ttl = ttl
+        self.serve_stale = serve_stale
+        # (値, 世代, 計算開始時刻, サイズ)
+        self._entries = LRUCache(
+            max_entries=max_entries, ttl=max(max_stale, ttl), max_bytes=max_bytes, sizeof=lambda entry: entry[3]
+        )
+        self._generations: Dict[int, int] = {}
+        self._refreshing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def mark_clicked(self, url_ids: Iterable[int]) -> None:
+        """クリックを記録したURLのエントリを古い扱いにする（コミット後に呼ぶ）"""
+        with self._lock:
+            for url_id in url_ids:
+                self._generations[url_id] = self._generations.get(url_id, 0) + 1
+
+    async def get_or_compute(self, key: Hashable, url_id: int, compute: Callable[[], Awaitable[Any]],
+                             cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """キャッシュ済みなら返し、なければ compute() の結果を保存して返す"""
+        if self.ttl <= 0:
+            return await compute()
+        
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, generation, computed_at, _ = entry
+            if generation == self._generation(url_id) and time.monotonic() - computed_at < self.ttl:
+                self.fresh_hits += 1
+                return value
+            if self.serve_stale:
+                self.stale_hits += 1
+                self._schedule_refresh(key, url_id, compute, cacheable)
+                return value
+        
+        return await self._refresh(key, url_id, compute, cacheable)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._entries.stats(),
+            "ttl": self.ttl,
+            "max_stale": self._entries.ttl,
+            "serve_stale": self.serve_stale,
+            "fresh_hits": self.fresh_hits,
+            "stale_hits": self.stale_hits,
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures
+        }
+
+    def _generation(self, url_id: int) -> int:
+        with self._lock:
+            return self._generations.get(url_id, 0)
+
+    async def _refresh(self, key: Hashable, url_id: int, compute: Callable[[], Awaitable[Any]],
+                       cacheable: Optional[Callable[[Any], bool]]) -> Any:
+        # 計算中に記録されたクリックで世代が進めば、保存した結果は次回古い扱いになる
+        generation = self._generation(url_id)
+        computed_at = time.monotonic()
+        value = await compute()
+        if cacheable is None or cacheable(value):
+            self._entries.set(key, (value, generation, computed_at, _estimate_size(value)))
+        return value
+
+    def _schedule_refresh(self, key: Hashable, url_id: int, compute: Callable[[], Awaitable[Any]],
+                          cacheable: Optional[Callable[[Any], bool]]) -> None:
+        """同じキーの再計算は1つだけ走らせる"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        task = asyncio.get_running_loop().create_task(self._background_refresh(key, url_id, compute, cacheable))
+        # タスクが途中で回収されないよう参照を保持
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _background_refresh(self, key: Hashable, url_id: int, compute: Callable[[], Awaitable[Any]],
+                                  cacheable: Optional[Callable[[Any], bool]]) -> None:
+        try:
+            await self._refresh(key, url_id, compute, cacheable)
+            self.refreshes += 1
+        except Exception as e:
+            # 失敗しても古いエントリは残し、次のアクセスで再試行する
+            self.refresh_failures += 1
+            print(f"⚠️  Analytics cache refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+# short_code -> (url_id, original_url, is_active)
+# 存在しないコードは (None, None, False) として短時間だけキャッシュし、作成時にも無効化する
+url_cache = UrlCache(
+    max_entries=URL_CACHE_SIZE,
+    ttl=URL_CACHE_TTL or None,
+    miss_entries=URL_MISS_CACHE_SIZE,
+    miss_ttl=URL_MISS_CACHE_TTL
+)
+
+analytics_cache = AnalyticsCache(
+    max_entries=ANALYTICS_CACHE_ENTRIES,
+    ttl=ANALYTICS_CACHE_TTL,
+    max_stale=ANALYTICS_CACHE_MAX_STALE,
+    max_bytes=ANALYTICS_CACHE_BYTES,
+    serve_stale=ANALYTICS_CACHE_SERVE_STALE
+)
@@ -0,0 +1,204 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# レコード形式: [ペイロード長 4byte | CRC32 4byte | JSONペイロード]
+_HEADER = struct.Struct('<II')
+SEGMENT_PREFIX = 'clicks-'
+SEGMENT_SUFFIX = '.seg'
+ACTIVE_SUFFIX = '.active'
+
+class ClickJournal:
+    """クリックの追記専用ジャーナル
+
+    レコードはバッファなしでセグメントファイルへ書き込むため、プロセスが
+    落ちてもOSのページキャッシュに残る。fsyncはsync()でまとめて行い
+    （グループコミット）、OSクラッシュ時の損失はfsync間隔分に限られる。
+
+    書き込み中のセグメントは .active としてロックを保持し、封印時に .seg へ
+    リネームする。複数ワーカーが同じディレクトリを共有しても、他ワーカーの
+    書き込み中セグメントが取り込まれることはない。
+
+    セグメントの切り替えはロック内でファイルを差し替えるだけにし、古い
+    セグメントのfsyncとリネームはジャーナルスレッドが sync()／rotate()／
+    close() でロック外に行う。append() がディスク待ちで止まることはない。
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = 4 * 1024 * 1024):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._active_path: Optional[str] = None
+        self._active_size = 0
+        self._dirty = False
+        self._seq = 0
+        # 切り替え済みで封印待ちのセグメント [(ファイル, パス, サイズ, 未fsync)]
+        self._retired: List[tuple] = []
+        self.appended = 0
+        self.syncs = 0
+
+    def open(self) -> None:
+        """ディレクトリを用意し、孤立セグメントを回収して新しいセグメントを開く"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover_orphans()
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+
+    def close(self) -> None:
+        with self._lock:
+            self._retire_segment()
+        self._seal_retired()
+
+    def append(self, row: Sequence[Any]) -> None:
+        """1クリックを追記（上限サイズを超えたらセグメントを切り替え）"""
+        payload = json.dumps(list(row), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._file is None:
+                raise RuntimeError("Click journal is not open")
+            self._file.write(record)
+            self._active_size += len(record)
+            self._dirty = True
+            self.appended += 1
+            if self._active_size >= self.segment_max_bytes:
+                # 封印は次の sync() でジャーナルスレッドが行う
+                self._retire_segment()
+                self._open_segment()
+
+    def sync(self) -> None:
+        """未fsyncの追記をディスクへ反映し（グループコミット）、封印待ちのセグメントを封印"""
+        self._seal_retired()
+        with self._lock:
+            if not self._dirty or self._file is None:
+                return
+            self._dirty = False
+            # fsync中も追記をブロックしないよう複製したfdで同期する
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+            self.syncs += 1
+        finally:
+            os.close(fd)
+
+    def rotate(self) -> None:
+        """アクティブセグメントを新しいセグメントに切り替えて封印"""
+        with self._lock:
+            if self._file is not None and self._active_size > 0:
+                self._retire_segment()
+                self._open_segment()
+        self._seal_retired()
+
+    def sealed_segments(self) -> List[str]:
+        """圧縮待ちの封印済みセグメント（古い順）"""
+        return self._list_segments(SEGMENT_SUFFIX)
+
+    def read_segment(self, path: str) -> List[List[Any]]:
+        """セグメントを読み込む（途中で切れた末尾レコードは捨てる）"""
+        rows: List[List[Any]] = []
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                print(f"⚠️  Truncated record in {os.path.basename(path)} at offset {offset}, skipping tail")
+                break
+            rows.append(json.loads(payload))
+            offset = start + length
+        return rows
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "appended": self.appended,
+            "syncs": self.syncs,
+            "pending_segments": len(self.sealed_segments())
+        }
+
+    def _list_segments(self, suffix: str) -> List[str]:
+        try:
+            names = sorted(
+                name for name in os.listdir(self.directory)
+                if name.startswith(SEGMENT_PREFIX) and name.endswith(suffix)
+            )
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _recover_orphans(self) -> None:
+        """クラッシュしたプロセスの .active セグメントを封印済みにする"""
+        for path in self._list_segments(ACTIVE_SUFFIX):
+            sealed = path[:-len(ACTIVE_SUFFIX)] + SEGMENT_SUFFIX
+            if fcntl is None:
+                os.rename(path, sealed)
+                continue
+            with open(path, 'ab') as f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # 稼働中の別ワーカーが書き込み中
+                os.rename(path, sealed)
+            print(f"♻️  Recovered orphaned journal segment {os.path.basename(sealed)}")
+
+    def _open_segment(self) -> None:
+        self._seq += 1
+        # 名前にプロセスIDと時刻を含め、他ワーカーや再起動前のセグメントと衝突しないようにする
+        name = f"{SEGMENT_PREFIX}{time.time_ns():020d}-{os.getpid()}-{self._seq:06d}{ACTIVE_SUFFIX}"
+        self._active_path = os.path.join(self.directory, name)
+        self._file = open(self._active_path, 'ab', buffering=0)
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._active_size = 0
+        self._dirty = False
+
+    def _retire_segment(self) -> None:
+        """アクティブセグメントを封印待ちに回す（ロック内で呼ぶ。ディスク待ちはしない）"""
+        if self._file is None:
+            return
+        self._retired.append((self._file, self._active_path, self._active_size, self._dirty))
+        self._file = None
+        self._active_path = None
+        self._active_size = 0
+        self._dirty = False
+
+    def _seal_retired(self) -> None:
+        """封印待ちのセグメントをfsyncして .seg にリネーム（ロック外で呼ぶ）"""
+        with self._lock:
+            retired, self._retired = self._retired, []
+        for file, path, size, dirty in retired:
+            if dirty:
+                os.fsync(file.fileno())
+                self.syncs += 1
+            
+            if size == 0:
+                file.close()
+                os.remove(path)
+            else:
+                sealed = path[:-len(ACTIVE_SUFFIX)] + SEGMENT_SUFFIX
+                if fcntl is not None:
+                    # ロックを保持したままリネームし、孤立回収との競合を防ぐ
+                    os.rename(path, sealed)
+                    file.close()
+                else:
+                    file.close()
+                    os.rename(path, sealed)
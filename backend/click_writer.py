@@ -0,0 +1,255 @@
+import queue
+import sqlite3
+import threading
+import time
+import os
+from typing import Any, Dict, List, Optional, Sequence
+from config import (
+    CLICK_BATCH_SIZE, CLICK_FLUSH_INTERVAL_MS, CLICK_QUEUE_SIZE,
+    CLICK_JOURNAL_DIR, CLICK_JOURNAL_FSYNC_MS, CLICK_JOURNAL_COMPACT_MS, CLICK_JOURNAL_SEGMENT_BYTES
+)
+from cache import analytics_cache
+from click_journal import ClickJournal
+from database import DatabaseWriter, db_writer
+from rollups import last_click_id, rollup_clicks_after
+
+# キューに積むタプルの列順（clicksテーブルの列名と一致）
+CLICK_COLUMNS = (
+    'url_id', 'ip_address', 'country', 'region', 'city', 'timezone',
+    'user_agent', 'referrer', 'device_type', 'browser', 'os', 'source',
+    'utm_source', 'utm_medium', 'utm_campaign',
+    'created_at', 'hour_of_day', 'day_of_week'
+)
+
+INSERT_CLICK_SQL = (
+    f"INSERT INTO clicks ({', '.join(CLICK_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in CLICK_COLUMNS)})"
+)
+
+def _insert_clicks(conn: sqlite3.Connection, rows: List[Sequence[Any]]) -> None:
+    """クリックを一括INSERTし、同じトランザクションで集計表にも加算（ライタースレッドで実行）"""
+    after_id = last_click_id(conn)
+    conn.executemany(INSERT_CLICK_SQL, rows)
+    rollup_clicks_after(conn, after_id)
+
+def _prune_segment_log(conn: sqlite3.Connection) -> None:
+    """取り込み記録は他ワーカーとの競合を避けるため一定期間残してから削除"""
+    conn.execute("DELETE FROM click_journal_segments WHERE applied_at < datetime('now', '-1 day')")
+
+def _load_segment(conn: sqlite3.Connection, name: str, rows: List[Sequence[Any]], batch_size: int) -> bool:
+    """セグメントを取り込み済みとして記録し、未取り込みならINSERT（ライタースレッドで実行）
+
+    古い取り込み記録の削除も同じトランザクションで行い、取り込むものが無い間は書き込まない。
+    """
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO click_journal_segments (name, row_count) VALUES (?, ?)",
+        (name, len(rows))
+    )
+    if not cursor.rowcount:
+        return False
+    after_id = last_click_id(conn)
+    for i in range(0, len(rows), batch_size):
+        conn.executemany(INSERT_CLICK_SQL, rows[i:i + batch_size])
+    rollup_clicks_after(conn, after_id)
+    _prune_segment_log(conn)
+    return True
+
+class ClickWriter:
+    """クリックをバックグラウンドスレッドで一括INSERTする
+
+    INSERT自体は単一ライター（DatabaseWriter）へバッチ単位で依頼する。
+
+    journalを渡した場合はメモリキューの代わりにジャーナルへ追記し、
+    fsync間隔ごとにグループコミット、圧縮間隔ごとに封印済みセグメントを
+    clicksテーブルへ取り込む。起動時には前回取り込まれなかったセグメントを再生する。
+    """
+
+    def __init__(self, writer: DatabaseWriter, batch_size: int = 500,
+                 flush_interval_ms: int = 200, max_queue_size: int = 10000,
+                 journal: Optional[ClickJournal] = None,
+                 fsync_interval_ms: int = 50, compact_interval_ms: int = 1000):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.journal = journal
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.compact_interval = compact_interval_ms / 1000
+        self._queue: "queue.Queue[Sequence[Any]]" = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.replayed = 0
+
+    def start(self) -> None:
+        """書き込みスレッドを起動（ジャーナル使用時は未取り込みセグメントを先に再生）"""
+        if self._thread and self._thread.is_alive():
+            return
+        if self.journal:
+            self.journal.open()
+            self.replayed += self._compact()
+            if self.replayed:
+                print(f"♻️  Replayed {self.replayed} clicks from journal")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="click-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """キューを書き出してからスレッドを停止"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, row: Sequence[Any]) -> bool:
+        """クリックをジャーナルまたはキューに追加（失敗・満杯ならFalse）"""
+        if self.journal:
+            try:
+                self.journal.append(row)
+            except Exception as e:
+                print(f"⚠️  Failed to append click to journal: {e}")
+                self.dropped += 1
+                return False
+            self.enqueued += 1
+            return True
+        
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "replayed": self.replayed
+        }
+        if self.journal:
+            stats["journal"] = self.journal.stats()
+        return stats
+
+    def _run(self) -> None:
+        if self.journal:
+            self._run_journal()
+            return
+        
+        while not self._stop_event.is_set():
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+
+        # シャットダウン時は残りをすべて書き出す
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._flush(batch)
+
+    def _run_journal(self) -> None:
+        last_compact = time.monotonic()
+        while not self._stop_event.wait(self.fsync_interval):
+            self.journal.sync()
+            if time.monotonic() - last_compact >= self.compact_interval:
+                self.journal.rotate()
+                self._compact()
+                last_compact = time.monotonic()
+
+        # シャットダウン時はアクティブセグメントも封印して取り込む
+        self.journal.close()
+        self._compact()
+
+    def _compact(self) -> int:
+        """封印済みセグメントをclicksへ取り込み、コミット後に削除する
+
+        取り込み済みセグメント名を同じトランザクションで記録するため、
+        削除前にクラッシュしても、他ワーカーと同時に取り込もうとしても
+        二重取り込みはされない。
+        """
+        loaded = 0
+        for path in self.journal.sealed_segments():
+            name = os.path.basename(path)
+            try:
+                rows = self.journal.read_segment(path)
+                if self.writer.call(_load_segment, name, rows, self.batch_size):
+                    loaded += len(rows)
+                    analytics_cache.mark_clicked({row[0] for row in rows})
+            except Exception as e:
+                # 失敗したセグメントは残し、次回の圧縮で再試行する
+                print(f"⚠️  Failed to compact journal segment {name}: {e}")
+                break
+            
+            self.journal.remove(path)
+        
+        if loaded:
+            self.written += loaded
+            self.batches += 1
+        return loaded
+
+    def _collect(self) -> List[Sequence[Any]]:
+        """batch_size件またはflush間隔に達するまでキューから取り出す"""
+        batch: List[Sequence[Any]] = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self) -> List[Sequence[Any]]:
+        batch: List[Sequence[Any]] = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[Sequence[Any]], retries: int = 3) -> None:
+        """1トランザクションでexecutemany"""
+        for attempt in range(retries):
+            try:
+                self.writer.call(_insert_clicks, batch)
+                # 行の先頭は url_id（CLICK_COLUMNS 参照）
+                analytics_cache.mark_clicked({row[0] for row in batch})
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except sqlite3.OperationalError as e:
+                # database is locked などは少し待って再試行
+                print(f"⚠️  Click batch write failed (attempt {attempt + 1}): {e}")
+                time.sleep(0.1 * (attempt + 1))
+            except Exception as e:
+                print(f"⚠️  Click batch write failed: {e}")
+                break
+
+        self.failed += len(batch)
+
+click_writer = ClickWriter(
+    db_writer,
+    batch_size=CLICK_BATCH_SIZE,
+    flush_interval_ms=CLICK_FLUSH_INTERVAL_MS,
+    max_queue_size=CLICK_QUEUE_SIZE,
+    journal=ClickJournal(CLICK_JOURNAL_DIR, CLICK_JOURNAL_SEGMENT_BYTES) if CLICK_JOURNAL_DIR else None,
+    fsync_interval_ms=CLICK_JOURNAL_FSYNC_MS,
+    compact_interval_ms=CLICK_JOURNAL_COMPACT_MS
+)
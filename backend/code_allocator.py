@@ -0,0 +1,236 @@
+import hashlib
+import os
+import socket
+import sqlite3
+import string
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from config import SHORT_CODE_LENGTH, SHORT_CODE_SECRET, CODE_LEASE_BLOCK_SIZE, CODE_LEASE_TTL_SECONDS
+
+# utils.generate_short_code と同じ文字集合
+ALPHABET = string.ascii_letters + string.digits
+BASE = len(ALPHABET)
+FEISTEL_ROUNDS = 6
+
+class FeistelPermutation:
+    """[0, domain) 上の可逆な擬似ランダム置換
+
+    2^(2*half_bits) 上のFeistelネットワークで置換し、domainを超えた値は
+    範囲内に入るまで置換を繰り返す（cycle walking）。入力が異なれば
+    出力も必ず異なるため、連番を通すだけで重複のない値が得られる。
+    """
+
+    def __init__(self, domain: int, key: bytes, rounds: int = FEISTEL_ROUNDS):
+        self.domain = domain
+        self.rounds = rounds
+        self.half_bits = (max(domain - 1, 1).bit_length() + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self._keys = [
+            hashlib.blake2b(key + bytes([i]), digest_size=16).digest()
+            for i in range(rounds)
+        ]
+
+    def _round(self, i: int, value: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, 'big'), key=self._keys[i], digest_size=8).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for i in range(self.rounds):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for i in reversed(range(self.rounds)):
+            left, right = right ^ self._round(i, left), left
+        return (left << self.half_bits) | right
+
+    def permute(self, value: int) -> int:
+        if not 0 <= value < self.domain:
+            raise ValueError("value out of domain")
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+        return value
+
+    def invert(self, value: int) -> int:
+        if not 0 <= value < self.domain:
+            raise ValueError("value out of domain")
+        value = self._decrypt(value)
+        while value >= self.domain:
+            value = self._decrypt(value)
+        return value
+
+def encode_base62(value: int, length: int) -> str:
+    """固定長のbase62文字列に変換"""
+    chars = []
+    for _ in range(length):
+        value, rem = divmod(value, BASE)
+        chars.append(ALPHABET[rem])
+    return ''.join(reversed(chars))
+
+class ShortCodeAllocator:
+    """単調増加カウンタを置換して短縮コードを割り当てる
+
+    カウンタ n は長さ SHORT_CODE_LENGTH の空間 (62^6) から順に使い、
+    使い切ると1文字長い空間へ移る。同じ鍵である限りコードは構造上
+    重複しないため、存在確認のSELECTは不要。
+
+    カウンタはワーカーごとにブロック単位でリース（code_leases）し、
+    リース内の値はメモリから払い出す。払い出し位置はURLのINSERTと同じ
+    トランザクションで自分のリース行にだけ記録するため、ワーカー間で
+    共有カウンタ行を奪い合うことはない。一定時間更新のないリースは
+    ワーカーが落ちたものとみなし、残りの範囲を別のワーカーが引き継ぐ。
+
+    SHORT_CODE_SECRET を変更すると置換が変わり、発行済みコードと
+    衝突しうるため、運用開始後は変更しないこと。
+    """
+
+    def __init__(self, secret: str, min_length: int = 6,
+                 block_size: int = 1000, lease_ttl: float = 300.0):
+        self.min_length = min_length
+        self.block_size = block_size
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._key = secret.encode('utf-8')
+        self._permutations = {}
+        self._lock = threading.Lock()
+        # 現在のリース（id, 次に払い出す値, 範囲の終端）
+        self._lease_id: Optional[int] = None
+        self._lease_next = 0
+        self._lease_end = 0
+        self.leases_acquired = 0
+        self.leases_reclaimed = 0
+        self.allocated = 0
+
+    def _permutation(self, length: int) -> FeistelPermutation:
+        perm = self._permutations.get(length)
+        if perm is None:
+            perm = FeistelPermutation(BASE ** length, self._key + bytes([length]))
+            self._permutations[length] = perm
+        return perm
+
+    def code_for(self, counter: int) -> str:
+        """カウンタ値からコードを求める"""
+        length = self.min_length
+        while counter >= BASE ** length:
+            counter -= BASE ** length
+            length += 1
+        return encode_base62(self._permutation(length).permute(counter), length)
+
+    def reserve(self, conn: sqlite3.Connection, count: int = 1) -> int:
+        """共有カウンタを count 進め、予約した範囲の先頭を返す（書き込みトランザクション内で呼ぶ）"""
+        conn.execute("INSERT OR IGNORE INTO short_code_counter (id, next_value) VALUES (1, 0)")
+        conn.execute("UPDATE short_code_counter SET next_value = next_value + ? WHERE id = 1", (count,))
+        next_value = conn.execute("SELECT next_value FROM short_code_counter WHERE id = 1").fetchone()[0]
+        return next_value - count
+
+    def allocate(self, conn: sqlite3.Connection, count: int = 1) -> List[str]:
+        """count 個のコードを割り当てる（書き込みトランザクション内で呼ぶ）
+
+        リースを使い切ったら次のブロックを取得する。トランザクションが
+        ロールバックされた場合はリース行の払い出し位置（取得したリース
+        自体も）が巻き戻るため、次回の割り当てでリース行を読み直し、
+        まだ自分のリースなら巻き戻った位置から同じ値を払い出し直す。
+        """
+        with self._lock:
+            values: List[int] = []
+            while len(values) < count:
+                if self._lease_id is None or self._lease_next >= self._lease_end:
+                    self._acquire_lease(conn, count - len(values))
+                
+                take = min(count - len(values), self._lease_end - self._lease_next)
+                start = self._lease_next
+                # 所有者と払い出し位置が一致する場合のみ進める（他ワーカーに回収済みなら0件）
+                cursor = conn.execute(
+                    "UPDATE code_leases SET next_value = ?, heartbeat_at = ? "
+                    "WHERE id = ? AND owner = ? AND next_value = ?",
+                    (start + take, time.time(), self._lease_id, self.owner, start)
+                )
+                if not cursor.rowcount:
+                    self._resync_lease(conn)
+                    continue
+                
+                self._lease_next = start + take
+                values.extend(range(start, start + take))
+            
+            self.allocated += count
+        return [self.code_for(n) for n in values]
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """シャットダウン時にリースを手放し、残りの範囲をすぐ再利用できるようにする"""
+        with self._lock:
+            if self._lease_id is not None:
+                conn.execute(
+                    "UPDATE code_leases SET heartbeat_at = 0 WHERE id = ? AND owner = ?",
+                    (self._lease_id, self.owner)
+                )
+                self._lease_id = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "owner": self.owner,
+            "block_size": self.block_size,
+            "lease_remaining": self._lease_end - self._lease_next if self._lease_id is not None else 0,
+            "leases_acquired": self.leases_acquired,
+            "leases_reclaimed": self.leases_reclaimed,
+            "allocated": self.allocated
+        }
+
+    def _resync_lease(self, conn: sqlite3.Connection) -> None:
+        """リース行と払い出し位置が食い違ったとき、行の内容に合わせ直す
+
+        ロールバックで位置が巻き戻っただけなら行の位置から続け、他ワーカーに
+        回収された・リースの取得自体が巻き戻った場合は手放して次を取得する。
+        """
+        row = conn.execute(
+            "SELECT owner, next_value, range_end FROM code_leases WHERE id = ?",
+            (self._lease_id,)
+        ).fetchone()
+        if row and row[0] == self.owner:
+            self._lease_next, self._lease_end = row[1], row[2]
+        else:
+            self._lease_id = None
+
+    def _acquire_lease(self, conn: sqlite3.Connection, needed: int) -> None:
+        """期限切れリースの残りを引き継ぐか、共有カウンタから新しいブロックを予約する"""
+        now = time.time()
+        conn.execute("DELETE FROM code_leases WHERE next_value >= range_end")
+        
+        row = conn.execute(
+            "SELECT id, next_value, range_end FROM code_leases "
+            "WHERE heartbeat_at < ? ORDER BY range_start LIMIT 1",
+            (now - self.lease_ttl,)
+        ).fetchone()
+        if row:
+            lease_id, next_value, range_end = row
+            conn.execute(
+                "UPDATE code_leases SET owner = ?, heartbeat_at = ? WHERE id = ?",
+                (self.owner, now, lease_id)
+            )
+            self.leases_reclaimed += 1
+        else:
+            # 大量生成時は1回の予約で足りるようブロックを広げる
+            size = max(self.block_size, needed)
+            next_value = self.reserve(conn, size)
+            range_end = next_value + size
+            lease_id = conn.execute(
+                "INSERT INTO code_leases (owner, range_start, range_end, next_value, heartbeat_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.owner, next_value, range_end, next_value, now)
+            ).lastrowid
+            self.leases_acquired += 1
+        
+        self._lease_id = lease_id
+        self._lease_next = next_value
+        self._lease_end = range_end
+
+code_allocator = ShortCodeAllocator(
+    SHORT_CODE_SECRET,
+    min_length=SHORT_CODE_LENGTH,
+    block_size=CODE_LEASE_BLOCK_SIZE,
+    lease_ttl=CODE_LEASE_TTL_SECONDS
+)
@@ -0,0 +1,182 @@
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+from config import NUMPY_AVAILABLE, ANALYTICS_COLUMNAR_MIN_ROWS
+from rollups import NULL_TEXT, dimension_value
+
+# 参照元・デバイス・国は uint16 の辞書コードで持つ
+MAX_DICTIONARY_SIZE = 1 << 16
+FETCH_CHUNK_ROWS = 65536
+SECONDS_PER_DAY = 86400
+
+LINK_ROLLUP_SQL = '''
+    SELECT hour_bucket, source, device_type, country, hour_of_day, day_of_week, clicks
+    FROM click_rollup_dims
+    WHERE url_id = ?
+'''
+
+class LinkColumns:
+    """1リンク分の時間別集計行を列ごとの配列にしたもの
+
+    時間枠は UTC のエポック秒（int64）、参照元・デバイス・国は値を昇順に
+    並べた辞書へのコード（uint16）で持つ。辞書は昇順のため、コードの大小が
+    値の並び順（NULLを表す空文字が先頭）と一致する。
+    """
+
+    __slots__ = ('epoch', 'source', 'device', 'country', 'hour', 'weekday', 'clicks',
+                 'sources', 'devices', 'countries')
+
+    def __init__(self, epoch, source, device, country, hour, weekday, clicks,
+                 sources: List[str], devices: List[str], countries: List[str]):
+        self.epoch = epoch
+        self.source = source
+        self.device = device
+        self.country = country
+        self.hour = hour
+        self.weekday = weekday
+        self.clicks = clicks
+        self.sources = sources
+        self.devices = devices
+        self.countries = countries
+
+def _sorted_dictionary(codes_by_value: Dict[str, int]):
+    """出現順に振ったコードを、値の昇順のコードへ付け替える表を作る"""
+    import numpy as np
+    values = sorted(codes_by_value)
+    remap = np.empty(len(values), dtype=np.uint16)
+    for code, value in enumerate(values):
+        remap[codes_by_value[value]] = code
+    return values, remap
+
+def load_link_columns(conn: sqlite3.Connection, url_id: int) -> Optional[LinkColumns]:
+    """リンクの集計行を読み込む（辞書が uint16 に収まらない場合は None）"""
+    import numpy as np
+    buckets: Dict[str, int] = {}
+    sources: Dict[str, int] = {}
+    devices: Dict[str, int] = {}
+    countries: Dict[str, int] = {}
+
+    cursor = conn.execute(LINK_ROLLUP_SQL, (url_id,))
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_CHUNK_ROWS)
+        if not rows:
+            break
+        chunks.append(np.array([
+            (buckets.setdefault(hour_bucket, len(buckets)), sources.setdefault(source, len(sources)),
+             devices.setdefault(device_type, len(devices)), countries.setdefault(country, len(countries)),
+             hour, weekday, clicks)
+            for hour_bucket, source, device_type, country, hour, weekday, clicks in rows
+        ], dtype=np.int64))
+        if max(len(sources), len(devices), len(countries)) > MAX_DICTIONARY_SIZE:
+            return None
+
+    table = np.concatenate(chunks) if chunks else np.empty((0, 7), dtype=np.int64)
+    bucket_epochs = np.array(list(buckets), dtype='datetime64[s]').astype(np.int64)
+    source_values, source_remap = _sorted_dictionary(sources)
+    device_values, device_remap = _sorted_dictionary(devices)
+    country_values, country_remap = _sorted_dictionary(countries)
+
+    return LinkColumns(
+        epoch=bucket_epochs[table[:, 0]],
+        source=source_remap[table[:, 1]],
+        device=device_remap[table[:, 2]],
+        country=country_remap[table[:, 3]],
+        # 範囲外の値も範囲判定まで元の値のまま持つ（狭い型に詰めると桁あふれで別の枠に入る）
+        hour=table[:, 4],
+        weekday=table[:, 5],
+        clicks=table[:, 6],
+        sources=source_values,
+        devices=device_values,
+        countries=country_values
+    )
+
+def _ranked(counts, values: List[str]) -> List[Tuple[Any, int]]:
+    """件数の降順（同数は値の昇順）、件数0は除く"""
+    import numpy as np
+    order = np.lexsort((np.arange(len(counts)), -counts))
+    return [(dimension_value(values[code]), int(counts[code])) for code in order if counts[code] > 0]
+
+def _weighted_counts(codes, weights, size: int):
+    import numpy as np
+    return np.bincount(codes, weights=weights, minlength=size).astype(np.int64)
+
+def aggregate_columns(columns: LinkColumns, recent_from_epoch: int) -> Dict[str, Any]:
+    """合計・日別（recent_from_epoch 以降の時間枠）・内訳・時間帯・曜日・日別トップを集計
+
+    bincount の重み付き合計は float64 だが、2^53 未満の整数の和は正確に求まる。
+    """
+    import numpy as np
+    clicks = columns.clicks
+    is_qr = (columns.source == columns.sources.index('qr')) if 'qr' in columns.sources \
+        else np.zeros(len(clicks), dtype=bool)
+    days = columns.epoch // SECONDS_PER_DAY
+
+    # 日別（直近分のみ）
+    recent = columns.epoch >= recent_from_epoch
+    recent_days, recent_index = np.unique(days[recent], return_inverse=True)
+    recent_clicks = clicks[recent]
+    daily_clicks = _weighted_counts(recent_index, recent_clicks, len(recent_days))
+    daily_qr = _weighted_counts(recent_index, recent_clicks * is_qr[recent], len(recent_days))
+    day_labels = np.datetime_as_string(recent_days.astype('datetime64[D]'))
+    daily = {
+        str(day): [int(total), int(qr)]
+        for day, total, qr in zip(day_labels, daily_clicks, daily_qr)
+    }
+
+    # 日別トップ（日×デバイス×参照元のキーごとに合計し、日ごとに件数の降順・値の昇順で先頭）
+    top_pairs: Dict[str, Tuple[Any, Any]] = {}
+    if len(clicks):
+        all_days, day_index = np.unique(days, return_inverse=True)
+        n_devices, n_sources = len(columns.devices), len(columns.sources)
+        pair_keys = (day_index * n_devices + columns.device) * n_sources + columns.source
+        keys, key_index = np.unique(pair_keys, return_inverse=True)
+        key_clicks = _weighted_counts(key_index, clicks, len(keys))
+        key_day = keys // (n_devices * n_sources)
+        key_device = keys // n_sources % n_devices
+        key_source = keys % n_sources
+        order = np.lexsort((key_source, key_device, -key_clicks, key_day))
+        first_of_day = order[np.r_[True, key_day[order][1:] != key_day[order][:-1]]]
+        all_day_labels = np.datetime_as_string(all_days.astype('datetime64[D]'))
+        for i in first_of_day:
+            top_pairs[str(all_day_labels[key_day[i]])] = (
+                dimension_value(columns.devices[key_device[i]]),
+                dimension_value(columns.sources[key_source[i]])
+            )
+
+    # 国別は Unknown と NULL を除く
+    country_counts = _weighted_counts(columns.country, clicks, len(columns.countries))
+    for excluded in ('Unknown', NULL_TEXT):
+        if excluded in columns.countries:
+            country_counts[columns.countries.index(excluded)] = 0
+
+    valid_hours = (columns.hour >= 0) & (columns.hour < 24)
+    valid_weekdays = (columns.weekday >= 0) & (columns.weekday < 7)
+
+    return {
+        'total_clicks': int(clicks.sum()),
+        'qr_clicks': int(clicks[is_qr].sum()),
+        'daily': daily,
+        'top_pairs': top_pairs,
+        'devices': _ranked(_weighted_counts(columns.device, clicks, len(columns.devices)), columns.devices),
+        'sources': _ranked(_weighted_counts(columns.source, clicks, len(columns.sources)), columns.sources),
+        'countries': _ranked(country_counts, columns.countries),
+        'hourly': [int(n) for n in _weighted_counts(columns.hour[valid_hours], clicks[valid_hours], 24)],
+        'weekly': [int(n) for n in _weighted_counts(columns.weekday[valid_weekdays], clicks[valid_weekdays], 7)]
+    }
+
+def aggregate_large_link(conn: sqlite3.Connection, url_id: int, recent_from: str) -> Optional[Dict[str, Any]]:
+    """集計行が ANALYTICS_COLUMNAR_MIN_ROWS 以上のリンクを列指向で集計（対象外なら None）
+
+    recent_from は日別の対象となる最初の時間枠（'YYYY-MM-DD HH:00:00'）。
+    """
+    if not NUMPY_AVAILABLE or ANALYTICS_COLUMNAR_MIN_ROWS <= 0:
+        return None
+    rows = conn.execute("SELECT COUNT(*) FROM click_rollup_dims WHERE url_id = ?", (url_id,)).fetchone()[0]
+    if rows < ANALYTICS_COLUMNAR_MIN_ROWS:
+        return None
+
+    import numpy as np
+    columns = load_link_columns(conn, url_id)
+    if columns is None:
+        return None
+    return aggregate_columns(columns, int(np.datetime64(recent_from, 's').astype(np.int64)))
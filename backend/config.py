@@ -43,4 +43,112 @@ try:
     import pandas as pd
     PANDAS_AVAILABLE: bool = True
 except ImportError:
-    PANDAS_AVAILABLE: bool = False
\ No newline at end of file
+    PANDAS_AVAILABLE: bool = False
+
+try:
+    import pyarrow
+    PYARROW_AVAILABLE: bool = True
+except ImportError:
+    PYARROW_AVAILABLE: bool = False
+
+try:
+    import numpy
+    NUMPY_AVAILABLE: bool = True
+except ImportError:
+    NUMPY_AVAILABLE: bool = False
+
+# 短縮コード解決キャッシュ設定（TTL=0で無期限）
+URL_CACHE_SIZE = int(os.getenv("URL_CACHE_SIZE", "10000"))
+URL_CACHE_TTL = float(os.getenv("URL_CACHE_TTL", "300"))
+# 存在しないコードは別枠で短時間だけ覚える（TTL=0で記憶しない）。他ワーカーで作成された
+# コードもこの秒数で見えるようになり、ランダムなコードの走査で有効なエントリが追い出されない
+URL_MISS_CACHE_SIZE = int(os.getenv("URL_MISS_CACHE_SIZE", "2048"))
+URL_MISS_CACHE_TTL = float(os.getenv("URL_MISS_CACHE_TTL", "5"))
+
+# 分析レスポンスのキャッシュ（TTL=0で無効。クリック記録またはTTL経過で古いとみなし、
+# SERVE_STALE有効時は MAX_STALE 秒までは古い結果を返しながら裏で再計算する）
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "30"))
+ANALYTICS_CACHE_MAX_STALE = float(os.getenv("ANALYTICS_CACHE_MAX_STALE", "300"))
+ANALYTICS_CACHE_ENTRIES = int(os.getenv("ANALYTICS_CACHE_ENTRIES", "1024"))
+ANALYTICS_CACHE_BYTES = int(os.getenv("ANALYTICS_CACHE_BYTES", str(16 * 1024 * 1024)))
+ANALYTICS_CACHE_SERVE_STALE = os.getenv("ANALYTICS_CACHE_SERVE_STALE", "true").lower() in ("1", "true", "yes")
+
+# 時間別集計行がこの件数以上のリンクは numpy の列指向集計を使う（0で無効、numpy未導入時も無効）
+ANALYTICS_COLUMNAR_MIN_ROWS = int(os.getenv("ANALYTICS_COLUMNAR_MIN_ROWS", "20000"))
+
+# クロス集計レポート（pandas必須。read_sql で1回に読む行数と、1レポートのセル数上限）
+REPORT_CHUNK_ROWS = int(os.getenv("REPORT_CHUNK_ROWS", "50000"))
+REPORT_MAX_CELLS = int(os.getenv("REPORT_MAX_CELLS", "100000"))
+
+# クリック一括書き込み設定
+CLICK_BATCH_SIZE = int(os.getenv("CLICK_BATCH_SIZE", "500"))
+CLICK_FLUSH_INTERVAL_MS = int(os.getenv("CLICK_FLUSH_INTERVAL_MS", "200"))
+CLICK_QUEUE_SIZE = int(os.getenv("CLICK_QUEUE_SIZE", "50000"))
+
+# クリックジャーナル設定（空文字でジャーナル無効＝メモリキューのみ）
+CLICK_JOURNAL_DIR = os.getenv("CLICK_JOURNAL_DIR", "click_journal")
+CLICK_JOURNAL_FSYNC_MS = int(os.getenv("CLICK_JOURNAL_FSYNC_MS", "50"))
+CLICK_JOURNAL_COMPACT_MS = int(os.getenv("CLICK_JOURNAL_COMPACT_MS", "1000"))
+CLICK_JOURNAL_SEGMENT_BYTES = int(os.getenv("CLICK_JOURNAL_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+
+# DB実行スレッドプールのサイズ（リダイレクト / 書き込み / 分析・エクスポート）
+REDIRECT_DB_THREADS = int(os.getenv("REDIRECT_DB_THREADS", "8"))
+WRITE_DB_THREADS = int(os.getenv("WRITE_DB_THREADS", "2"))
+ANALYTICS_DB_THREADS = int(os.getenv("ANALYTICS_DB_THREADS", "2"))
+
+# 分析集計用プロセスプール（詳細分析・キャンペーン分析・レポート。0で無効化し分析用DBスレッドで実行）
+# uvicorn のワーカーごとに作られるため、既定は固定の小さな値。合計（ワーカー数×この値）がコア数を超えないよう設定する
+# 実行待ち＋実行中が MAX_PENDING 件に達したら503、TIMEOUT 秒を過ぎたら504を返す
+ANALYTICS_PROCESSES = int(os.getenv("ANALYTICS_PROCESSES", "2"))
+ANALYTICS_TASK_TIMEOUT = float(os.getenv("ANALYTICS_TASK_TIMEOUT", "30"))
+ANALYTICS_MAX_PENDING = int(os.getenv("ANALYTICS_MAX_PENDING", "32"))
+
+# 短縮コード割り当て（SECRETは運用開始後に変更しないこと）
+SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", "6"))
+SHORT_CODE_SECRET = os.getenv("SHORT_CODE_SECRET", "link-tracker-short-code")
+# ワーカーごとに予約するコード範囲と、落ちたワーカーのリースを回収するまでの秒数
+CODE_LEASE_BLOCK_SIZE = int(os.getenv("CODE_LEASE_BLOCK_SIZE", "1000"))
+CODE_LEASE_TTL_SECONDS = float(os.getenv("CODE_LEASE_TTL_SECONDS", "300"))
+
+# 一括生成ジョブ（BULK_JOB_THRESHOLD件を超えると画面からジョブとして実行）
+BULK_JOB_WORKERS = int(os.getenv("BULK_JOB_WORKERS", "2"))
+BULK_JOB_CHUNK_SIZE = int(os.getenv("BULK_JOB_CHUNK_SIZE", "500"))
+BULK_JOB_THRESHOLD = int(os.getenv("BULK_JOB_THRESHOLD", "1000"))
+
+# 一括生成（登録チャンクの件数と、ストリーミング時の送信待ち行数の上限）
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "200"))
+BULK_STREAM_BUFFER_SIZE = int(os.getenv("BULK_STREAM_BUFFER_SIZE", "256"))
+# ストリーミング応答（一括生成・QR ZIPエクスポート）を進めるスレッド数。超えた分は空きを待つ
+BULK_STREAM_THREADS = int(os.getenv("BULK_STREAM_THREADS", "4"))
+
+# SQLite接続プール（読み取り専用）・PRAGMA設定
+# リダイレクト用DBスレッドは REDIRECT_DB_THREADS 本の専用プールを使い、それ以外の読み取り
+# （分析・エクスポート・一覧・レポート・一括ジョブ）はこの共有プールを使う
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(
+    WRITE_DB_THREADS + ANALYTICS_DB_THREADS + BULK_STREAM_THREADS + BULK_JOB_WORKERS
+)))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+DB_WRITER_QUEUE_SIZE = int(os.getenv("DB_WRITER_QUEUE_SIZE", "10000"))
+
+# QR画像キャッシュ（メモリLRUと、本体とは別ファイルのSQLite。空文字でディスク側を無効化）
+QR_CACHE_DB_PATH = os.getenv("QR_CACHE_DB_PATH", "qr_cache.db")
+QR_CACHE_MEMORY_ENTRIES = int(os.getenv("QR_CACHE_MEMORY_ENTRIES", "4096"))
+QR_CACHE_MEMORY_BYTES = int(os.getenv("QR_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+# 単体QR取得（キャッシュ参照・未キャッシュ分の描画と保存）を実行するスレッド数
+QR_THREADS = int(os.getenv("QR_THREADS", "2"))
+
+# QR描画プロセスプール（0で無効化し呼び出しスレッドで描画）
+# uvicorn のワーカーごとに作られるため、既定は固定の小さな値。合計（ワーカー数×この値）がコア数を超えないよう設定する
+QR_RENDER_PROCESSES = int(os.getenv("QR_RENDER_PROCESSES", "2"))
+QR_RENDER_CHUNK_SIZE = int(os.getenv("QR_RENDER_CHUNK_SIZE", "32"))
+
+# キャンペーン単位のQR ZIPエクスポートで1回に読み込む件数
+QR_EXPORT_BATCH_SIZE = int(os.getenv("QR_EXPORT_BATCH_SIZE", "200"))
+
+# /api/urls で base64 QR を埋め込める1ページあたりの最大件数
+URLS_INLINE_QR_MAX = int(os.getenv("URLS_INLINE_QR_MAX", "50"))
@@ -1,12 +1,241 @@
 import sqlite3
-from config import DB_PATH
+import asyncio
+import functools
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterator, Optional
+from config import (
+    DB_PATH, REDIRECT_DB_THREADS, WRITE_DB_THREADS, ANALYTICS_DB_THREADS, BULK_STREAM_THREADS, QR_THREADS,
+    DB_POOL_SIZE, DB_POOL_TIMEOUT, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB,
+    SQLITE_MMAP_SIZE, SQLITE_SYNCHRONOUS, SQLITE_STATEMENT_CACHE, DB_WRITER_QUEUE_SIZE
+)
+from rollups import create_rollup_tables, last_click_id, rebuild_rollups
+
+# 用途別のDB実行スレッドプール（重い分析クエリがリダイレクトを止めないよう分離）
+DB_EXECUTOR_SIZES = {
+    "redirect": REDIRECT_DB_THREADS,
+    "write": WRITE_DB_THREADS,
+    "analytics": ANALYTICS_DB_THREADS,
+    # 一括生成ストリームの送信側とQR ZIPエクスポート（クライアントの受信待ちで止まるため書き込み用とは分ける）
+    "stream": BULK_STREAM_THREADS,
+    # QR画像の描画とQRキャッシュDBへの保存（CPU処理のためリダイレクト用とは分ける）
+    "qr": QR_THREADS
+}
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+def create_connection(db_path: str = DB_PATH, readonly: bool = False) -> sqlite3.Connection:
+    """チューニング済みのSQLite接続を作成（readonly=Trueで書き込み禁止）"""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,  # プール経由でスレッド間を移動するため
+        cached_statements=SQLITE_STATEMENT_CACHE
+    )
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA cache_size = -{int(SQLITE_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(SQLITE_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+class ConnectionPool:
+    """事前設定済みSQLite接続のプール
+
+    接続は初回利用時に作成して使い回し、ページキャッシュとプリペアド
+    ステートメントキャッシュを保持したままにする。貸し出し時に
+    ヘルスチェックを行い、壊れた接続は作り直す。
+    """
+
+    def __init__(self, db_path: str, max_size: int, timeout: float = 30.0, readonly: bool = False):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.readonly = readonly
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self.created = 0
+        self.discarded = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """接続を借りて、ブロック終了時に返却"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Database connection pool exhausted")
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+            self._slots.release()
+
+    def close_all(self) -> None:
+        """待機中の接続をすべて閉じる"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_size": self.max_size,
+            "idle": self._idle.qsize(),
+            "created": self.created,
+            "discarded": self.discarded
+        }
+
+    def _checkout(self) -> sqlite3.Connection:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    self.created += 1
+                return create_connection(self.db_path, readonly=self.readonly)
+            
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def _checkin(self, conn: sqlite3.Connection) -> None:
+        try:
+            # 未コミットの変更は返却時に破棄
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except sqlite3.Error:
+            self._discard(conn)
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self.discarded += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+class DatabaseWriter:
+    """全ての書き込みを1本の専用接続で直列実行するライタースレッド
+
+    コマンド func(conn, *args) をキュー経由で受け取り、1コマンドを
+    1トランザクション（BEGIN IMMEDIATE … COMMIT）として実行する。
+    例外時はロールバックして呼び出し元へ再送出する。WALモードのため、
+    読み取り専用プールからの読み取りが書き込みをブロックすることはない。
+    """
+
+    def __init__(self, db_path: str, max_queue_size: int = 10000):
+        self.db_path = db_path
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """キュー済みのコマンドを実行し終えてから停止"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, func: Callable[..., Any], *args: Any) -> "Future[Any]":
+        """書き込みコマンドを投入（キューが満杯なら空くまで待つ）"""
+        return self._enqueue(func, args, block=True)
+
+    def call(self, func: Callable[..., Any], *args: Any) -> Any:
+        """書き込みコマンドを実行して結果を待つ（同期版）"""
+        return self.submit(func, *args).result()
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """書き込みコマンドを実行して結果を待つ（非同期版）
+
+        キューが満杯のときは空きを待つ put を別スレッドで行い、イベントループは止めない。
+        """
+        try:
+            future = self._enqueue(func, args, block=False)
+        except queue.Full:
+            future = await asyncio.to_thread(self._enqueue, func, args, True)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "queued": self._queue.qsize(),
+            "executed": self.executed,
+            "failed": self.failed
+        }
+
+    def _enqueue(self, func: Callable[..., Any], args: tuple, block: bool) -> "Future[Any]":
+        """コマンドをキューに入れる（block=False で満杯なら queue.Full）"""
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+        future: "Future[Any]" = Future()
+        self._queue.put((func, args, future), block=block)
+        return future
+
+    def _run(self) -> None:
+        conn = create_connection(self.db_path)
+        conn.isolation_level = None  # トランザクションは明示的に管理
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                func, args, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    result = func(conn, *args)
+                    conn.execute("COMMIT")
+                except BaseException as e:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    self.failed += 1
+                    future.set_exception(e)
+                else:
+                    self.executed += 1
+                    future.set_result(result)
+        finally:
+            conn.close()
+
+# 読み取りは読み取り専用プール、書き込みは単一ライターが担当
+# リダイレクトの解決は専用プールを使い、分析・エクスポート等で共有プールが埋まっても待たない
+redirect_pool = ConnectionPool(DB_PATH, max_size=REDIRECT_DB_THREADS, timeout=DB_POOL_TIMEOUT, readonly=True)
+db_pool = ConnectionPool(DB_PATH, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, readonly=True)
+db_writer = DatabaseWriter(DB_PATH, max_queue_size=DB_WRITER_QUEUE_SIZE)
 
 def init_db() -> bool:
     """データベース初期化"""
     print(f"🔧 Initializing enhanced database at: {DB_PATH}")
     
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = create_connection(DB_PATH)
         cursor = conn.cursor()
         
         # URLsテーブル（強化版）
@@ -49,9 +278,77 @@ def init_db() -> bool:
             )
         ''')
         
+        # クリックジャーナルの取り込み済みセグメント（二重取り込み防止）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS click_journal_segments (
+                name TEXT PRIMARY KEY,
+                row_count INTEGER,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 短縮コード割り当てカウンタ（code_allocator参照）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS short_code_counter (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                next_value INTEGER NOT NULL
+            )
+        ''')
+        
+        # ワーカーごとのコード範囲リース
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS code_leases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner TEXT NOT NULL,
+                range_start INTEGER NOT NULL,
+                range_end INTEGER NOT NULL,
+                next_value INTEGER NOT NULL,
+                heartbeat_at REAL NOT NULL
+            )
+        ''')
+        
+        # 一括生成ジョブ（jobs参照）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bulk_jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total_items INTEGER NOT NULL,
+                processed_items INTEGER NOT NULL DEFAULT 0,
+                success_count INTEGER NOT NULL DEFAULT 0,
+                error_count INTEGER NOT NULL DEFAULT 0,
+                payload TEXT,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bulk_job_results (
+                job_id TEXT NOT NULL,
+                item_index INTEGER NOT NULL,
+                original_url TEXT NOT NULL,
+                custom_name TEXT,
+                campaign_name TEXT,
+                short_code TEXT,
+                error TEXT,
+                created_at TIMESTAMP,
+                PRIMARY KEY (job_id, item_index)
+            )
+        ''')
+        
+        # クリックの集計表・管理画面用の集計値（rollups参照）。新規作成時は既存データから構築する
+        if create_rollup_tables(conn):
+            if last_click_id(conn):
+                print("♻️  Backfilling click rollups from existing clicks")
+            rebuild_rollups(conn)
+        
         # インデックス作成（パフォーマンス向上）
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_urls_short_code ON urls(short_code)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_urls_is_active ON urls(is_active)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_urls_active_created_at ON urls(is_active, created_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bulk_jobs_status ON bulk_jobs(status)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_clicks_url_id ON clicks(url_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_clicks_created_at ON clicks(created_at)')
         
@@ -65,6 +362,36 @@ def init_db() -> bool:
         traceback.print_exc()
         return False
 
-def get_db_connection() -> sqlite3.Connection:
-    """データベース接続を取得"""
-    return sqlite3.connect(DB_PATH)
\ No newline at end of file
+def get_db_connection() -> ContextManager[sqlite3.Connection]:
+    """読み取り専用プールから接続を借りる（with文で使用、書き込みはdb_writer経由）"""
+    return db_pool.connection()
+
+def get_redirect_connection() -> ContextManager[sqlite3.Connection]:
+    """リダイレクト専用プールから接続を借りる（リダイレクト用DBスレッドからのみ使用）"""
+    return redirect_pool.connection()
+
+def get_executor(pool: str) -> ThreadPoolExecutor:
+    """用途別スレッドプールを取得（初回に作成）"""
+    with _executors_lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=DB_EXECUTOR_SIZES[pool],
+                thread_name_prefix=f"db-{pool}"
+            )
+            _executors[pool] = executor
+        return executor
+
+async def run_db(pool: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """ブロッキングなDB処理を専用スレッドプールで実行"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(pool), functools.partial(func, *args, **kwargs))
+
+def shutdown_executors() -> None:
+    """全スレッドプールを停止し、プール中の接続を閉じる"""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=True)
+        _executors.clear()
+    redirect_pool.close_all()
+    db_pool.close_all()
\ No newline at end of file
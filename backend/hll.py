@@ -0,0 +1,73 @@
+import hashlib
+import math
+import zlib
+from typing import Iterable, Optional
+
+# 精度 p=12（レジスタ 4096 個、1個1バイト）
+# 標準誤差は 1.04/√4096 ≈ 1.6%（推定値の約95%が真値の ±3.3% 以内）。
+# 推定値が 2.5m（10240）以下の範囲は線形カウンティングに切り替えるため、
+# 数百件程度までの少ない件数ではほぼ正確な値になる。
+# 保存済みのスケッチと互換性がなくなるため、運用開始後は変更しないこと。
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+_HASH_BITS = 64
+_REMAINDER_BITS = _HASH_BITS - HLL_PRECISION
+_REMAINDER_MASK = (1 << _REMAINDER_BITS) - 1
+_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+# マージ用: 全レジスタの最上位ビット（レジスタ値は最大 _REMAINDER_BITS + 1 < 128 のため常に0）
+_HIGH_BITS = int.from_bytes(b'\x80' * HLL_REGISTERS, 'big')
+
+class HyperLogLog:
+    """ユニーク数を推定するHyperLogLogスケッチ
+
+    同じ値を何度追加しても結果は変わらず、2つのスケッチの和集合は
+    レジスタごとの最大値で求められる。そのため日別・リンク別に保存した
+    スケッチを後から任意の範囲でマージして数えられる。
+    """
+
+    __slots__ = ('registers',)
+
+    def __init__(self, registers: Optional[bytes] = None):
+        self.registers = bytearray(registers) if registers else bytearray(HLL_REGISTERS)
+
+    def add(self, value: str) -> None:
+        hashed = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = hashed >> _REMAINDER_BITS
+        # 残りのビットの先頭から数えた最初の1の位置
+        rank = _REMAINDER_BITS - (hashed & _REMAINDER_MASK).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[str]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """other との和集合にする（全レジスタを1つの整数として一度に最大値をとる）"""
+        a = int.from_bytes(self.registers, 'big')
+        b = int.from_bytes(other.registers, 'big')
+        # 各バイトで (0x80 + a - b) の最上位ビットが立つのは a >= b のとき
+        a_wins = (((a | _HIGH_BITS) - b) & _HIGH_BITS) >> 7
+        mask = (a_wins << 8) - a_wins
+        self.registers = bytearray((b ^ ((a ^ b) & mask)).to_bytes(HLL_REGISTERS, 'big'))
+
+    def count(self) -> int:
+        registers = self.registers
+        harmonic = sum(registers.count(rank) * 2.0 ** -rank for rank in set(registers))
+        estimate = _ALPHA * HLL_REGISTERS * HLL_REGISTERS / harmonic
+        if estimate <= 2.5 * HLL_REGISTERS:
+            zeros = registers.count(0)
+            if zeros:
+                estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        """保存用に圧縮（件数が少ないうちはほとんどのレジスタが0のため数十バイトになる）"""
+        return zlib.compress(bytes(self.registers), 1)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        registers = zlib.decompress(data)
+        if len(registers) != HLL_REGISTERS:
+            raise ValueError("HyperLogLog sketch has unexpected size")
+        return cls(registers)
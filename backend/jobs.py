@@ -0,0 +1,235 @@
+import json
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from config import BASE_URL, BULK_JOB_WORKERS, BULK_JOB_CHUNK_SIZE
+from models import BulkGenerationItem
+from database import DatabaseWriter, db_writer, get_db_connection
+from cache import url_cache
+from bulk_insert import insert_bulk_items
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+class JobConflict(Exception):
+    """他のワーカーが同じジョブを先に進めていた"""
+
+def _create_job(conn: sqlite3.Connection, job_id: str, kind: str, items: List[Dict[str, Any]]) -> None:
+    """ジョブを登録（ライタースレッドで実行）"""
+    conn.execute(
+        "INSERT INTO bulk_jobs (id, kind, status, total_items, payload) VALUES (?, ?, ?, ?, ?)",
+        (job_id, kind, JOB_QUEUED, len(items), json.dumps(items, ensure_ascii=False))
+    )
+
+def _set_status(conn: sqlite3.Connection, job_id: str, status: str, error: Optional[str] = None) -> None:
+    conn.execute(
+        "UPDATE bulk_jobs SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (status, error, job_id)
+    )
+
+def _apply_chunk(conn: sqlite3.Connection, job_id: str, offset: int,
+                 items: List[BulkGenerationItem], total: int) -> List[str]:
+    """1チャンク分のURLと結果・進捗を同じトランザクションで登録（ライタースレッドで実行）
+
+    進捗が offset と一致する場合のみ適用するため、再起動後の再開や
+    複数ワーカーでの同時再開でもチャンクが二重に登録されることはない。
+    """
+    created_at, outcomes = insert_bulk_items(conn, items)
+
+    conn.executemany(
+        "INSERT INTO bulk_job_results "
+        "(job_id, item_index, original_url, custom_name, campaign_name, short_code, error, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (job_id, offset + i, item.original_url, item.custom_name, item.campaign_name,
+             short_code, error, created_at if short_code else None)
+            for i, (item, (short_code, error)) in enumerate(zip(items, outcomes))
+        ]
+    )
+
+    success = sum(1 for short_code, _ in outcomes if short_code)
+    processed = offset + len(items)
+    cursor = conn.execute('''
+        UPDATE bulk_jobs
+        SET processed_items = ?, success_count = success_count + ?, error_count = error_count + ?,
+            status = ?, payload = CASE WHEN ? THEN NULL ELSE payload END,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND processed_items = ?
+    ''', (processed, success, len(items) - success,
+          JOB_COMPLETED if processed >= total else JOB_RUNNING, processed >= total,
+          job_id, offset))
+    if not cursor.rowcount:
+        raise JobConflict(f"Job {job_id} already advanced past offset {offset}")
+
+    return [short_code for short_code, _ in outcomes if short_code]
+
+class BulkJobManager:
+    """大量の一括生成をバックグラウンドで処理するジョブキュー
+
+    ジョブの入力・進捗・結果はSQLiteに保存し、チャンク単位で単一ライターへ
+    書き込む。チャンクの登録と進捗更新は同じトランザクションで行うため、
+    再起動時は未完了のジョブを続きのチャンクから再開できる。
+    """
+
+    def __init__(self, writer: DatabaseWriter, max_workers: int = 2, chunk_size: int = 500):
+        self.writer = writer
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._active = set()
+        self.completed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """ワーカーを起動し、前回完了しなかったジョブを再開"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._stop_event.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bulk-job")
+
+        with get_db_connection() as conn:
+            rows = conn.execute(
+                "SELECT id FROM bulk_jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        for (job_id,) in rows:
+            print(f"♻️  Resuming bulk job {job_id}")
+            self._schedule(job_id)
+
+    def stop(self) -> None:
+        """処理中のチャンクが終わるのを待って停止（未完了のジョブは次回起動時に再開）"""
+        self._stop_event.set()
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, items: List[BulkGenerationItem], kind: str = 'bulk_generate') -> Dict[str, Any]:
+        """ジョブを登録してキューに積む"""
+        job_id = uuid.uuid4().hex
+        self.writer.call(_create_job, job_id, kind, [item.model_dump() for item in items])
+        self._schedule(job_id)
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with get_db_connection() as conn:
+            row = conn.execute('''
+                SELECT id, kind, status, total_items, processed_items, success_count, error_count,
+                       error, created_at, updated_at
+                FROM bulk_jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+        if not row:
+            return None
+
+        total, processed = row[3], row[4]
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "total_items": total,
+            "processed_items": processed,
+            "success_count": row[5],
+            "error_count": row[6],
+            "progress": round(processed / total, 4) if total else 1.0,
+            "error": row[7],
+            "created_at": row[8],
+            "updated_at": row[9],
+            "status_url": f"{BASE_URL}/api/jobs/{row[0]}",
+            "results_url": f"{BASE_URL}/api/jobs/{row[0]}/results"
+        }
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """結果を item_index 順にページ単位で取得"""
+        with get_db_connection() as conn:
+            rows = conn.execute('''
+                SELECT item_index, original_url, custom_name, campaign_name, short_code, error, created_at
+                FROM bulk_job_results
+                WHERE job_id = ? AND item_index >= ?
+                ORDER BY item_index
+                LIMIT ?
+            ''', (job_id, offset, limit)).fetchall()
+
+        results = []
+        for item_index, original_url, custom_name, campaign_name, short_code, error, created_at in rows:
+            result = {
+                "index": item_index,
+                "original_url": original_url,
+                "custom_name": custom_name,
+                "campaign_name": campaign_name,
+                "short_code": short_code,
+                "error": error
+            }
+            if short_code:
+                result.update({
+                    "short_url": f"{BASE_URL}/{short_code}",
+                    "qr_url": f"{BASE_URL}/{short_code}?source=qr",
+                    "created_at": created_at
+                })
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._executor is not None,
+            "workers": self.max_workers,
+            "active_jobs": len(self._active),
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+    def _schedule(self, job_id: str) -> None:
+        with self._lock:
+            if self._executor is None or job_id in self._active:
+                return
+            self._active.add(job_id)
+            self._executor.submit(self._process, job_id)
+
+    def _process(self, job_id: str) -> None:
+        """チャンクごとに登録し、停止要求があればチャンクの切れ目で中断する"""
+        try:
+            with get_db_connection() as conn:
+                row = conn.execute(
+                    "SELECT total_items, processed_items, payload FROM bulk_jobs WHERE id = ?",
+                    (job_id,)
+                ).fetchone()
+            if not row or row[2] is None:
+                return
+
+            total, offset = row[0], row[1]
+            items = [BulkGenerationItem(**item) for item in json.loads(row[2])]
+            if offset == 0:
+                self.writer.call(_set_status, job_id, JOB_RUNNING)
+
+            while offset < total:
+                if self._stop_event.is_set():
+                    return
+                chunk = items[offset:offset + self.chunk_size]
+                created = self.writer.call(_apply_chunk, job_id, offset, chunk, total)
+                for short_code in created:
+                    url_cache.invalidate(short_code)
+                offset += len(chunk)
+
+            self.completed += 1
+            print(f"✅ Bulk job {job_id} completed ({total} items)")
+        except JobConflict as e:
+            print(f"⚠️  {e}; another worker is processing it")
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ Bulk job {job_id} failed: {e}")
+            try:
+                self.writer.call(_set_status, job_id, JOB_FAILED, str(e))
+            except Exception as status_error:
+                print(f"⚠️  Failed to record bulk job failure: {status_error}")
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+bulk_jobs = BulkJobManager(db_writer, max_workers=BULK_JOB_WORKERS, chunk_size=BULK_JOB_CHUNK_SIZE)
@@ -1,11 +1,20 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from datetime import datetime
 from contextlib import asynccontextmanager
 import config
-from routes import redirect_router, shorten_router, analytics_router, bulk_router, export_router, admin_router
-from database import init_db
+from routes import redirect_router, shorten_router, analytics_router, stats_router, bulk_router, export_router, admin_router, jobs_router, qr_router, urls_router, reports_router
+from database import init_db, shutdown_executors, db_pool, redirect_pool, db_writer
+from cache import url_cache, analytics_cache
+from click_writer import click_writer
+from code_allocator import code_allocator
+from jobs import bulk_jobs
+from qr_cache import qr_cache
+from singleflight import analytics_flight
+from qr_render import shutdown_render_pool
+from analytics_executor import analytics_executor
 
 # ライフスパンハンドラーを使用
 @asynccontextmanager
@@ -24,10 +33,30 @@ async def lifespan(app: FastAPI):
     else:
         print("❌ Database initialization failed!")
     
+    db_writer.start()
+    click_writer.start()
+    bulk_jobs.start()
+    
     yield  # アプリケーション実行中
     
     # シャットダウン時処理
     print("🛑 Shutting down...")
+    
+    # 処理中のジョブはチャンクの切れ目で止め、次回起動時に再開する
+    await asyncio.to_thread(bulk_jobs.stop)
+    
+    # キューに残ったクリックを書き出す
+    await asyncio.to_thread(click_writer.stop)
+    print(f"💾 Click writer drained: {click_writer.stats()}")
+    shutdown_executors()
+    shutdown_render_pool()
+    analytics_executor.shutdown()
+    # 未使用のコード範囲を他ワーカーへ返す
+    try:
+        await db_writer.run(code_allocator.release)
+    except Exception as e:
+        print(f"⚠️  Failed to release short code lease: {e}")
+    await asyncio.to_thread(db_writer.stop)
 
 app = FastAPI(
     title="Enhanced Link Tracker API", 
@@ -50,7 +79,11 @@ app.include_router(analytics_router)  # /analytics/{short_code}
 app.include_router(bulk_router)       # /bulk と /api/bulk-generate
 app.include_router(shorten_router, prefix="/api")
 app.include_router(export_router, prefix="/api")
-app.include_router(redirect_router)   # 最後に動的なルート {short_code}
+app.include_router(jobs_router, prefix="/api")    # /api/jobs/...
+app.include_router(qr_router, prefix="/api")      # /api/qr/{short_code}
+app.include_router(urls_router, prefix="/api")    # /api/urls
+app.include_router(stats_router, prefix="/api")   # /api/stats/{short_code}, /api/analytics/campaign/...
+app.include_router(reports_router, prefix="/api") # /api/reports/pivot, /api/reports/{report_name}
 
 # ルートページ
 @app.get("/")
@@ -72,9 +105,23 @@ async def health_check():
         "status": "healthy", 
         "version": "2.0.0",
         "timestamp": datetime.now().isoformat(),
-        "base_url": config.BASE_URL
+        "base_url": config.BASE_URL,
+        "url_cache": url_cache.stats(),
+        "analytics_cache": analytics_cache.stats(),
+        "analytics_flight": analytics_flight.stats(),
+        "analytics_executor": analytics_executor.stats(),
+        "click_writer": click_writer.stats(),
+        "redirect_pool": redirect_pool.stats(),
+        "db_pool": db_pool.stats(),
+        "db_writer": db_writer.stats(),
+        "code_allocator": code_allocator.stats(),
+        "bulk_jobs": bulk_jobs.stats(),
+        "qr_cache": qr_cache.stats()
     }
 
+# 動的なルート {short_code} は /health 等を隠さないよう最後に登録
+app.include_router(redirect_router)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
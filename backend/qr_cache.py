@@ -0,0 +1,132 @@
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from config import QR_CACHE_DB_PATH, QR_CACHE_MEMORY_ENTRIES, QR_CACHE_MEMORY_BYTES
+from cache import LRUCache
+from database import ConnectionPool
+from qr_render import render_many
+
+QR_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+QR_ERROR_CORRECTIONS = ('L', 'M', 'Q', 'H')
+
+class QRCache:
+    """QR画像の2段キャッシュ（メモリLRU＋SQLiteのblobストア）
+
+    キーは (payload, size, format, error_correction) のハッシュで、同じ入力からは
+    常に同じ画像ができるため無効化は不要。ETagには画像本体のハッシュを使う。
+    ディスク側は本体DBとは別ファイルにし、リンク作成の書き込みと競合させない。
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 4096, max_bytes: int = 32 * 1024 * 1024):
+        self.db_path = db_path
+        self._memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes, sizeof=lambda entry: len(entry[0]))
+        self._pool = ConnectionPool(db_path, max_size=4) if db_path else None
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self.disk_hits = 0
+        self.renders = 0
+
+    def get(self, payload: str, size: int = 200, fmt: str = 'png',
+            error_correction: str = 'L') -> Optional[Tuple[bytes, str]]:
+        """(画像, ETag) を返す（未キャッシュなら描画して保存、描画不可ならNone）"""
+        return self.get_many([payload], size, fmt, error_correction)[0]
+
+    def get_many(self, payloads: List[str], size: int = 200, fmt: str = 'png',
+                 error_correction: str = 'L') -> List[Optional[Tuple[bytes, str]]]:
+        """複数のQRをまとめて取得（ディスクは1回のIN検索、未キャッシュ分は並列描画）"""
+        if fmt not in QR_FORMATS or error_correction not in QR_ERROR_CORRECTIONS:
+            raise ValueError(f"Unsupported QR format: {fmt}/{error_correction}")
+
+        keys = [
+            hashlib.sha256(f"{payload}\0{size}\0{fmt}\0{error_correction}".encode('utf-8')).hexdigest()
+            for payload in payloads
+        ]
+        entries: Dict[str, Tuple[bytes, str]] = {}
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry is not None:
+                entries[key] = entry
+
+        missing = [key for key in dict.fromkeys(keys) if key not in entries]
+        if missing:
+            loaded = self._load(missing)
+            self.disk_hits += len(loaded)
+            entries.update(loaded)
+
+            to_render = {key: payload for key, payload in zip(keys, payloads) if key not in entries}
+            if to_render:
+                images = render_many([(payload, size, fmt, error_correction) for payload in to_render.values()])
+                rendered = {
+                    key: (content, hashlib.sha256(content).hexdigest()[:32])
+                    for key, content in zip(to_render, images) if content is not None
+                }
+                self.renders += len(rendered)
+                self._store(rendered)
+                entries.update(rendered)
+
+            for key in missing:
+                if key in entries:
+                    self._memory.set(key, entries[key])
+
+        return [entries.get(key) for key in keys]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self._memory.stats(),
+            "disk_path": self.db_path or None,
+            "disk_hits": self.disk_hits,
+            "renders": self.renders
+        }
+
+    def _ensure_schema(self, conn: sqlite3.Connection) -> None:
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS qr_images (
+                        key TEXT PRIMARY KEY,
+                        etag TEXT NOT NULL,
+                        content BLOB NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                conn.commit()
+                self._schema_ready = True
+
+    def _load(self, keys: List[str]) -> Dict[str, Tuple[bytes, str]]:
+        if self._pool is None:
+            return {}
+        entries = {}
+        try:
+            with self._pool.connection() as conn:
+                self._ensure_schema(conn)
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    placeholders = ', '.join('?' for _ in chunk)
+                    rows = conn.execute(
+                        f"SELECT key, content, etag FROM qr_images WHERE key IN ({placeholders})", chunk
+                    )
+                    for key, content, etag in rows:
+                        entries[key] = (bytes(content), etag)
+        except sqlite3.Error as e:
+            print(f"⚠️  QR cache read failed: {e}")
+        return entries
+
+    def _store(self, entries: Dict[str, Tuple[bytes, str]]) -> None:
+        if self._pool is None or not entries:
+            return
+        try:
+            with self._pool.connection() as conn:
+                self._ensure_schema(conn)
+                conn.executemany(
+                    "INSERT OR IGNORE INTO qr_images (key, etag, content) VALUES (?, ?, ?)",
+                    [(key, etag, content) for key, (content, etag) in entries.items()]
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            # キャッシュの保存失敗は描画結果の返却を妨げない
+            print(f"⚠️  QR cache write failed: {e}")
+
+qr_cache = QRCache(QR_CACHE_DB_PATH, max_entries=QR_CACHE_MEMORY_ENTRIES, max_bytes=QR_CACHE_MEMORY_BYTES)
@@ -0,0 +1,143 @@
+import functools
+import multiprocessing
+import struct
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Sequence, Tuple
+from config import QR_AVAILABLE, QR_RENDER_PROCESSES, QR_RENDER_CHUNK_SIZE
+
+Matrix = Tuple[Tuple[bool, ...], ...]
+
+@functools.lru_cache(maxsize=1024)
+def qr_matrix(payload: str, error_correction: str = 'L') -> Matrix:
+    """QRのモジュール行列（余白4モジュール込み、True=黒）"""
+    import qrcode
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{error_correction}"),
+        border=4,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+def render_png(matrix: Matrix, size: int) -> bytes:
+    """指定ピクセル数の1bitグレースケールPNGを直接書き出す
+
+    各ピクセルを最近傍のモジュールに対応させる（PILで拡大・縮小した場合と
+    同じ見た目）。同じモジュール行に属するピクセル行は1度だけ組み立てる。
+    """
+    modules = len(matrix)
+    # ピクセル中心で標本化（PILの最近傍補間と同じ対応）し、各モジュールの横幅を求める
+    widths = [0] * modules
+    for x in range(size):
+        widths[(2 * x + 1) * modules // (2 * size)] += 1
+    padding = '0' * (-size % 8)
+
+    packed_rows = {}
+    raw = bytearray()
+    for y in range(size):
+        module_row = (2 * y + 1) * modules // (2 * size)
+        row = packed_rows.get(module_row)
+        if row is None:
+            # 1=白, 0=黒。各行の先頭にフィルタ種別(0: None)を付ける
+            bits = ''.join(('0' if dark else '1') * width for dark, width in zip(matrix[module_row], widths)) + padding
+            row = b'\x00' + int(bits, 2).to_bytes(len(bits) // 8, 'big')
+            packed_rows[module_row] = row
+        raw += row
+
+    header = struct.pack('>IIBBBBB', size, size, 1, 0, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + _png_chunk(b'IHDR', header)
+        + _png_chunk(b'IDAT', zlib.compress(bytes(raw)))
+        + _png_chunk(b'IEND', b'')
+    )
+
+def render_svg(matrix: Matrix, size: int) -> bytes:
+    """SVGで出力（黒モジュールの横方向の連なりを1つの矩形パスにまとめる）"""
+    modules = len(matrix)
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < modules:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < modules and row[x]:
+                x += 1
+            path.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">'
+        f'<rect width="{modules}" height="{modules}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(path)}"/></svg>'
+    ).encode('utf-8')
+
+RENDERERS = {
+    'png': render_png,
+    'svg': render_svg
+}
+
+def render_qr(payload: str, size: int = 200, fmt: str = 'png', error_correction: str = 'L') -> Optional[bytes]:
+    """QRコードを指定形式で描画（qrcode未導入ならNone）"""
+    if not QR_AVAILABLE:
+        return None
+    return RENDERERS[fmt](qr_matrix(payload, error_correction), size)
+
+# QR描画用のプロセスプール（CPU処理をGILの外で並列化）
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+def _render_task(args: Tuple[str, int, str, str]) -> Optional[bytes]:
+    return render_qr(*args)
+
+def get_render_pool() -> Optional[ProcessPoolExecutor]:
+    """プロセスプールを取得（QR_RENDER_PROCESSES=0 なら None）"""
+    global _render_pool
+    if QR_RENDER_PROCESSES <= 0:
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            # スレッドを持つ親プロセスからforkしないよう spawn を使う
+            _render_pool = ProcessPoolExecutor(
+                max_workers=QR_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _render_pool
+
+def render_many(requests: Sequence[Tuple[str, int, str, str]]) -> List[Optional[bytes]]:
+    """(payload, size, fmt, error_correction) の列をまとめて描画
+
+    チャンク1つ分に満たない件数はプロセス間通信の方が高くつくため
+    呼び出し元のスレッドで描画する。
+    """
+    global _render_pool
+    if not QR_AVAILABLE:
+        return [None] * len(requests)
+    
+    pool = get_render_pool() if len(requests) >= QR_RENDER_CHUNK_SIZE else None
+    if pool is not None:
+        try:
+            return list(pool.map(_render_task, requests, chunksize=QR_RENDER_CHUNK_SIZE))
+        except BrokenProcessPool as e:
+            print(f"⚠️  QR render pool broken, rendering in-process: {e}")
+            with _render_pool_lock:
+                if _render_pool is pool:
+                    _render_pool = None
+    return [render_qr(*request) for request in requests]
+
+def shutdown_render_pool() -> None:
+    global _render_pool
+    with _render_pool_lock:
+        pool = _render_pool
+        _render_pool = None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,142 @@
+import sqlite3
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from config import PYARROW_AVAILABLE, REPORT_CHUNK_ROWS, REPORT_MAX_CELLS
+from rollups import NULL_INT, NULL_TEXT
+
+# ディメンション名 -> (集計表での式, 生のclicksでの式)。集計表にない列は None
+# 集計表は NULL と空文字を区別しないため、生のclicksでも空文字を NULL として扱う
+REPORT_DIMENSIONS: Dict[str, Tuple[Optional[str], str]] = {
+    'day': ("substr(r.hour_bucket, 1, 10)", "date(c.created_at)"),
+    'hour': (f"NULLIF(r.hour_of_day, {NULL_INT})", "c.hour_of_day"),
+    'weekday': (f"NULLIF(r.day_of_week, {NULL_INT})", "c.day_of_week"),
+    'source': (f"NULLIF(r.source, '{NULL_TEXT}')", "NULLIF(c.source, '')"),
+    'device': (f"NULLIF(r.device_type, '{NULL_TEXT}')", "NULLIF(c.device_type, '')"),
+    'country': (f"NULLIF(r.country, '{NULL_TEXT}')", "NULLIF(c.country, '')"),
+    'browser': (None, "NULLIF(c.browser, '')"),
+    'os': (None, "NULLIF(c.os, '')"),
+    'campaign': ("u.campaign_name", "u.campaign_name"),
+    'short_code': ("u.short_code", "u.short_code"),
+}
+
+# 定義済みレポート: 名前 -> (行ディメンション, 列ディメンション)
+REPORT_PRESETS: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    'source-device-day': (('day',), ('source', 'device')),
+    'campaign-country': (('campaign',), ('country',)),
+}
+
+class ReportError(ValueError):
+    """レポートの指定が不正（APIでは400として返す）"""
+
+def parse_dimensions(value: str) -> Tuple[str, ...]:
+    """カンマ区切りのディメンション指定を検証してタプルにする"""
+    dimensions = tuple(name.strip() for name in value.split(',') if name.strip())
+    unknown = [name for name in dimensions if name not in REPORT_DIMENSIONS]
+    if unknown:
+        raise ReportError(f"Unknown dimension: {', '.join(unknown)} (available: {', '.join(REPORT_DIMENSIONS)})")
+    return dimensions
+
+def _report_query(dimensions: Sequence[str], short_code: Optional[str], campaign: Optional[str],
+                  start: Optional[date], end: Optional[date]) -> Tuple[str, list]:
+    """明細行を返すSQL（最後の列が件数の重み）
+
+    指定されたディメンションがすべて集計表にあれば時間別集計表を、
+    なければ生のclicksを読む。期間は日単位のため時間枠の境界と一致し、
+    どちらを読んでも同じ結果になる。
+    """
+    use_rollup = all(REPORT_DIMENSIONS[name][0] is not None for name in dimensions)
+    if use_rollup:
+        columns = [REPORT_DIMENSIONS[name][0] for name in dimensions] + ['r.clicks']
+        sql = f"SELECT {', '.join(columns)} FROM click_rollup_dims r JOIN urls u ON u.id = r.url_id"
+        time_column = 'r.hour_bucket'
+    else:
+        columns = [REPORT_DIMENSIONS[name][1] for name in dimensions] + ['1']
+        sql = f"SELECT {', '.join(columns)} FROM clicks c JOIN urls u ON u.id = c.url_id"
+        time_column = 'c.created_at'
+
+    conditions = ['u.is_active = TRUE']
+    params: list = []
+    if short_code:
+        conditions.append('u.short_code = ?')
+        params.append(short_code)
+    if campaign:
+        conditions.append('u.campaign_name = ?')
+        params.append(campaign)
+    if start:
+        conditions.append(f'{time_column} >= ?')
+        params.append(start.isoformat())
+    if end:
+        conditions.append(f'{time_column} < ?')
+        params.append((end + timedelta(days=1)).isoformat())
+    return f"{sql} WHERE {' AND '.join(conditions)}", params
+
+def _label(value: Any) -> Any:
+    """pandas の値をJSONにできる値へ（NA は None）"""
+    import pandas as pd
+    if value is None or value is pd.NA or (isinstance(value, float) and value != value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+def _keys(index) -> List[Any]:
+    """1段なら値、複数段なら値のリストを並べる"""
+    if index.nlevels == 1:
+        return [_label(value) for value in index]
+    return [[_label(value) for value in key] for key in index]
+
+def build_pivot(conn: sqlite3.Connection, rows: Sequence[str], columns: Sequence[str],
+                short_code: Optional[str] = None, campaign: Optional[str] = None,
+                start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+    """クリック数のクロス集計（rows × columns）を作成
+
+    明細は REPORT_CHUNK_ROWS 行ずつ read_sql で読み込み（pyarrow があれば
+    Arrow型）、チャンクごとに groupby で件数を集計してから合算するため、
+    メモリ使用量は明細の件数ではなく組み合わせの数に比例する。
+    """
+    import pandas as pd
+    dimensions = list(rows) + list(columns)
+    if not rows or len(set(dimensions)) != len(dimensions):
+        raise ReportError("rows must not be empty and dimensions must not repeat")
+
+    sql, params = _report_query(dimensions, short_code, campaign, start, end)
+    partials = []
+    for chunk in pd.read_sql(sql, conn, params=params, chunksize=REPORT_CHUNK_ROWS,
+                             dtype_backend='pyarrow' if PYARROW_AVAILABLE else 'numpy_nullable'):
+        chunk.columns = dimensions + ['clicks']
+        partials.append(chunk.groupby(dimensions, dropna=False, sort=False)['clicks'].sum())
+
+    levels = list(range(len(dimensions)))
+    counts = pd.concat(partials).groupby(level=levels, dropna=False).sum() if partials else None
+    if counts is None or counts.empty:
+        return {
+            "rows": list(rows), "columns": list(columns),
+            "row_keys": [], "column_keys": [], "values": [],
+            "row_totals": [], "column_totals": [], "total": 0
+        }
+
+    # 表の大きさは行キー・列キーの組み合わせ数で決まるため、密な表を作る前に上限を確認する
+    if columns:
+        row_count = len(counts.index.droplevel(levels[len(rows):]).unique())
+        column_count = len(counts.index.droplevel(levels[:len(rows)]).unique())
+    else:
+        row_count, column_count = len(counts), 1
+    cells = row_count * column_count
+    if cells > REPORT_MAX_CELLS:
+        raise ReportError(f"Report too large: {cells} cells (limit {REPORT_MAX_CELLS}); narrow the filters or dimensions")
+
+    if columns:
+        pivot = counts.unstack(level=levels[len(rows):], fill_value=0)
+    else:
+        pivot = counts.to_frame('clicks')
+    pivot = pivot.sort_index().sort_index(axis=1)
+
+    values = pivot.to_numpy(dtype='int64')
+    return {
+        "rows": list(rows),
+        "columns": list(columns),
+        "row_keys": _keys(pivot.index),
+        "column_keys": _keys(pivot.columns) if columns else [],
+        "values": values.tolist(),
+        "row_totals": values.sum(axis=1).tolist(),
+        "column_totals": values.sum(axis=0).tolist(),
+        "total": int(values.sum())
+    }
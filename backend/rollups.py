@@ -0,0 +1,303 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+from hll import HyperLogLog
+
+HOUR_BUCKET_FORMAT = '%Y-%m-%d %H:00:00'
+
+# 集計表の主キーにNULLは使えないため、NULLは空文字／-1に置き換えて保存する
+NULL_TEXT = ''
+NULL_INT = -1
+
+# ユニーク訪問者スケッチの集計キー（リンクの全期間／全リンク）
+ALL_DAYS = ''
+ALL_LINKS = 0
+SKETCH_IN_CHUNK_SIZE = 500
+
+CREATE_ROLLUP_TABLES = (
+    # URL×時間枠（UTC、clicks.created_at と同じ基準）ごとの合計
+    '''
+    CREATE TABLE IF NOT EXISTS click_rollup_hourly (
+        url_id INTEGER NOT NULL,
+        hour_bucket TEXT NOT NULL,
+        clicks INTEGER NOT NULL DEFAULT 0,
+        qr_clicks INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (url_id, hour_bucket)
+    ) WITHOUT ROWID
+    ''',
+    # URL×時間枠×参照元×デバイス×国×時刻×曜日ごとの件数
+    # （時刻・曜日はサーバーのローカル時刻で記録されているため時間枠からは求められない）
+    '''
+    CREATE TABLE IF NOT EXISTS click_rollup_dims (
+        url_id INTEGER NOT NULL,
+        hour_bucket TEXT NOT NULL,
+        source TEXT NOT NULL,
+        device_type TEXT NOT NULL,
+        country TEXT NOT NULL,
+        hour_of_day INTEGER NOT NULL,
+        day_of_week INTEGER NOT NULL,
+        clicks INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (url_id, hour_bucket, source, device_type, country, hour_of_day, day_of_week)
+    ) WITHOUT ROWID
+    ''',
+    # URL×日（UTC）ごとのユニーク訪問者（IP）のHyperLogLogスケッチ
+    # day = ALL_DAYS はリンクの全期間、url_id = ALL_LINKS は全リンクの合計
+    '''
+    CREATE TABLE IF NOT EXISTS click_unique_sketches (
+        url_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        sketch BLOB NOT NULL,
+        PRIMARY KEY (url_id, day)
+    ) WITHOUT ROWID
+    ''',
+    # 管理画面用にURLごと・全体の集計値を書き込み時に更新しておく
+    '''
+    CREATE TABLE IF NOT EXISTS url_stats (
+        url_id INTEGER PRIMARY KEY,
+        click_count INTEGER NOT NULL DEFAULT 0,
+        qr_count INTEGER NOT NULL DEFAULT 0,
+        unique_estimate INTEGER NOT NULL DEFAULT 0,
+        last_click_at TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS global_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_urls INTEGER NOT NULL DEFAULT 0,
+        total_clicks INTEGER NOT NULL DEFAULT 0,
+        qr_clicks INTEGER NOT NULL DEFAULT 0,
+        unique_estimate INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    "INSERT OR IGNORE INTO global_stats (id) VALUES (1)",
+    # 有効なURL数はURLの登録・削除・有効フラグ変更のたびにトリガーで増減する
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_urls_insert_stats AFTER INSERT ON urls
+    WHEN NEW.is_active
+    BEGIN
+        UPDATE global_stats SET total_urls = total_urls + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_urls_delete_stats AFTER DELETE ON urls
+    WHEN OLD.is_active
+    BEGIN
+        UPDATE global_stats SET total_urls = total_urls - 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_urls_active_stats AFTER UPDATE OF is_active ON urls
+    WHEN (OLD.is_active IS TRUE) != (NEW.is_active IS TRUE)
+    BEGIN
+        UPDATE global_stats
+        SET total_urls = total_urls + CASE WHEN NEW.is_active THEN 1 ELSE -1 END
+        WHERE id = 1;
+    END
+    '''
+)
+
+ROLLUP_TABLES = ('click_rollup_hourly', 'click_rollup_dims', 'click_unique_sketches', 'url_stats', 'global_stats')
+
+def create_rollup_tables(conn: sqlite3.Connection) -> bool:
+    """集計表を作成（1つでも新規に作成した場合はTrue。既存のクリックから作り直す必要がある）"""
+    placeholders = ', '.join('?' for _ in ROLLUP_TABLES)
+    existing = conn.execute(
+        f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ({placeholders})",
+        ROLLUP_TABLES
+    ).fetchone()[0]
+    for statement in CREATE_ROLLUP_TABLES:
+        conn.execute(statement)
+    return existing < len(ROLLUP_TABLES)
+
+def last_click_id(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT IFNULL(MAX(id), 0) FROM clicks").fetchone()[0]
+
+def rollup_clicks_after(conn: sqlite3.Connection, after_id: int) -> None:
+    """id が after_id より大きいクリックを集計表・ユニーク訪問者スケッチに加算（クリックのINSERTと同じトランザクションで呼ぶ）"""
+    conn.execute(f'''
+        INSERT INTO click_rollup_hourly (url_id, hour_bucket, clicks, qr_clicks)
+        SELECT url_id, strftime('{HOUR_BUCKET_FORMAT}', created_at) AS hour_bucket,
+               COUNT(*), COUNT(CASE WHEN source = 'qr' THEN 1 END)
+        FROM clicks
+        WHERE id > ? AND url_id IS NOT NULL AND created_at IS NOT NULL
+        GROUP BY url_id, hour_bucket
+        ON CONFLICT (url_id, hour_bucket) DO UPDATE SET
+            clicks = clicks + excluded.clicks,
+            qr_clicks = qr_clicks + excluded.qr_clicks
+    ''', (after_id,))
+    conn.execute(f'''
+        INSERT INTO click_rollup_dims
+            (url_id, hour_bucket, source, device_type, country, hour_of_day, day_of_week, clicks)
+        SELECT url_id, strftime('{HOUR_BUCKET_FORMAT}', created_at) AS hour_bucket,
+               IFNULL(source, '{NULL_TEXT}') AS source_key,
+               IFNULL(device_type, '{NULL_TEXT}') AS device_key,
+               IFNULL(country, '{NULL_TEXT}') AS country_key,
+               IFNULL(hour_of_day, {NULL_INT}) AS hour_key,
+               IFNULL(day_of_week, {NULL_INT}) AS weekday_key,
+               COUNT(*)
+        FROM clicks
+        WHERE id > ? AND url_id IS NOT NULL AND created_at IS NOT NULL
+        GROUP BY url_id, hour_bucket, source_key, device_key, country_key, hour_key, weekday_key
+        ON CONFLICT (url_id, hour_bucket, source, device_type, country, hour_of_day, day_of_week)
+        DO UPDATE SET clicks = clicks + excluded.clicks
+    ''', (after_id,))
+    conn.execute('''
+        INSERT INTO url_stats (url_id, click_count, qr_count, last_click_at)
+        SELECT url_id, COUNT(*), COUNT(CASE WHEN source = 'qr' THEN 1 END), MAX(created_at)
+        FROM clicks
+        WHERE id > ? AND url_id IS NOT NULL AND created_at IS NOT NULL
+        GROUP BY url_id
+        ON CONFLICT (url_id) DO UPDATE SET
+            click_count = click_count + excluded.click_count,
+            qr_count = qr_count + excluded.qr_count,
+            last_click_at = MAX(IFNULL(last_click_at, ''), excluded.last_click_at)
+    ''', (after_id,))
+    clicks, qr_clicks = conn.execute('''
+        SELECT COUNT(*), COUNT(CASE WHEN source = 'qr' THEN 1 END)
+        FROM clicks
+        WHERE id > ? AND url_id IS NOT NULL AND created_at IS NOT NULL
+    ''', (after_id,)).fetchone()
+    conn.execute(
+        "UPDATE global_stats SET total_clicks = total_clicks + ?, qr_clicks = qr_clicks + ? WHERE id = 1",
+        (clicks, qr_clicks)
+    )
+    _add_unique_visitors(conn, after_id)
+
+def _add_unique_visitors(conn: sqlite3.Connection, after_id: int) -> None:
+    """新しいクリックのIPを日別・全期間・全リンクのスケッチに加える（URL単位で順に保存）"""
+    rows = conn.execute('''
+        SELECT url_id, date(created_at), ip_address
+        FROM clicks
+        WHERE id > ? AND url_id IS NOT NULL AND created_at IS NOT NULL AND ip_address IS NOT NULL
+        ORDER BY url_id
+    ''', (after_id,))
+    
+    everyone = HyperLogLog()
+    current_url: Optional[int] = None
+    pending: Dict[str, HyperLogLog] = {}
+    for url_id, day, ip_address in rows:
+        if url_id != current_url:
+            if pending:
+                everyone.merge(pending[ALL_DAYS])
+                _store_sketches(conn, current_url, pending)
+            current_url, pending = url_id, {ALL_DAYS: HyperLogLog()}
+        sketch = pending.get(day)
+        if sketch is None:
+            sketch = pending[day] = HyperLogLog()
+        sketch.add(ip_address)
+        pending[ALL_DAYS].add(ip_address)
+    
+    if pending:
+        everyone.merge(pending[ALL_DAYS])
+        _store_sketches(conn, current_url, pending)
+        _store_sketches(conn, ALL_LINKS, {ALL_DAYS: everyone})
+        conn.execute("UPDATE global_stats SET unique_estimate = ? WHERE id = 1", (everyone.count(),))
+
+def _store_sketches(conn: sqlite3.Connection, url_id: int, sketches: Dict[str, HyperLogLog]) -> None:
+    """保存済みのスケッチとマージして書き戻し、url_stats の推定値も更新する"""
+    days = list(sketches)
+    placeholders = ', '.join('?' for _ in days)
+    for day, blob in conn.execute(
+        f"SELECT day, sketch FROM click_unique_sketches WHERE url_id = ? AND day IN ({placeholders})",
+        [url_id, *days]
+    ).fetchall():
+        sketches[day].merge(HyperLogLog.from_bytes(blob))
+    
+    conn.executemany(
+        "INSERT INTO click_unique_sketches (url_id, day, sketch) VALUES (?, ?, ?) "
+        "ON CONFLICT (url_id, day) DO UPDATE SET sketch = excluded.sketch",
+        [(url_id, day, sketch.to_bytes()) for day, sketch in sketches.items()]
+    )
+    if url_id != ALL_LINKS:
+        conn.execute(
+            "UPDATE url_stats SET unique_estimate = ? WHERE url_id = ?",
+            (sketches[ALL_DAYS].count(), url_id)
+        )
+
+def _load_sketches(conn: sqlite3.Connection, url_ids: Sequence[int],
+                   first_day: Optional[str], last_day: Optional[str]) -> Iterable[Tuple[int, bytes]]:
+    """期間指定がなければ全期間のスケッチ、あれば範囲内の日別スケッチを読む"""
+    if first_day is None and last_day is None:
+        conditions, params = ["day = ?"], [ALL_DAYS]
+    else:
+        conditions, params = ["day != ?"], [ALL_DAYS]
+        if first_day is not None:
+            conditions.append("day >= ?")
+            params.append(first_day)
+        if last_day is not None:
+            conditions.append("day <= ?")
+            params.append(last_day)
+    
+    for i in range(0, len(url_ids), SKETCH_IN_CHUNK_SIZE):
+        chunk = list(url_ids[i:i + SKETCH_IN_CHUNK_SIZE])
+        placeholders = ', '.join('?' for _ in chunk)
+        yield from conn.execute(
+            f"SELECT url_id, sketch FROM click_unique_sketches "
+            f"WHERE {' AND '.join(conditions)} AND url_id IN ({placeholders})",
+            [*params, *chunk]
+        )
+
+def unique_visitors(conn: sqlite3.Connection, url_ids: Sequence[int],
+                    first_day: Optional[str] = None, last_day: Optional[str] = None) -> Dict[int, int]:
+    """リンクごとのユニーク訪問者数の推定値（期間指定時は日別スケッチをマージ、誤差は hll 参照）"""
+    merged: Dict[int, HyperLogLog] = {}
+    for url_id, blob in _load_sketches(conn, url_ids, first_day, last_day):
+        sketch = HyperLogLog.from_bytes(blob)
+        if url_id in merged:
+            merged[url_id].merge(sketch)
+        else:
+            merged[url_id] = sketch
+    return {url_id: sketch.count() for url_id, sketch in merged.items()}
+
+def merged_unique_visitors(conn: sqlite3.Connection, url_ids: Sequence[int],
+                           first_day: Optional[str] = None, last_day: Optional[str] = None) -> int:
+    """複数リンクを合わせたユニーク訪問者数の推定値（同じIPは1人として数える）"""
+    merged = HyperLogLog()
+    for _, blob in _load_sketches(conn, url_ids, first_day, last_day):
+        merged.merge(HyperLogLog.from_bytes(blob))
+    return merged.count()
+
+def rebuild_rollups(conn: sqlite3.Connection) -> None:
+    """集計表をclicksから作り直す（1トランザクションで実行すること）"""
+    conn.execute("DELETE FROM click_rollup_hourly")
+    conn.execute("DELETE FROM click_rollup_dims")
+    conn.execute("DELETE FROM click_unique_sketches")
+    conn.execute("DELETE FROM url_stats")
+    conn.execute('''
+        UPDATE global_stats
+        SET total_urls = (SELECT COUNT(*) FROM urls WHERE is_active),
+            total_clicks = 0, qr_clicks = 0, unique_estimate = 0
+        WHERE id = 1
+    ''')
+    rollup_clicks_after(conn, 0)
+
+def dimension_value(value: Any) -> Any:
+    """集計表に保存した値を元の値に戻す（空文字／-1 は NULL）"""
+    return None if value == NULL_TEXT or value == NULL_INT else value
+
+def recent_window(days: int = 30) -> Tuple[str, str]:
+    """直近 days 日の集計範囲を (開始時刻, 開始時刻の次の時間枠) で返す
+
+    次の時間枠以降は集計表だけで求められる。開始時刻を含む時間枠は
+    途中から範囲に入るため、[開始時刻, 次の時間枠) だけ生のclicksから数える。
+    """
+    start = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0) - timedelta(days=days)
+    next_bucket = start.replace(minute=0, second=0) + timedelta(hours=1)
+    return start.strftime('%Y-%m-%d %H:%M:%S'), next_bucket.strftime(HOUR_BUCKET_FORMAT)
+
+if __name__ == "__main__":
+    # 既存のクリックから集計表を再構築: python rollups.py
+    from config import DB_PATH
+    from database import create_connection, init_db
+
+    init_db()
+    conn = create_connection(DB_PATH)
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rebuild_rollups(conn)
+        conn.execute("COMMIT")
+        hours = conn.execute("SELECT COUNT(*), IFNULL(SUM(clicks), 0) FROM click_rollup_hourly").fetchone()
+        print(f"✅ Rebuilt click rollups: {hours[1]} clicks in {hours[0]} url-hours")
+    finally:
+        conn.close()
@@ -1,15 +1,25 @@
 from .redirect import router as redirect_router
 from .shorten import router as shorten_router
 from .analytics import router as analytics_router
+from .analytics_old import router as stats_router
 from .bulk import router as bulk_router
 from .export import router as export_router
 from .admin import router as admin_router
+from .jobs import router as jobs_router
+from .qr import router as qr_router
+from .urls import router as urls_router
+from .reports import router as reports_router
 
 __all__ = [
     'redirect_router',
     'shorten_router', 
     'analytics_router',
+    'stats_router',
     'bulk_router',
     'export_router',
-    'admin_router'
+    'admin_router',
+    'jobs_router',
+    'qr_router',
+    'urls_router',
+    'reports_router'
 ]
\ No newline at end of file
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import HTMLResponse
-import sqlite3
-from config import DB_PATH, BASE_URL
+from config import BASE_URL
+from database import get_db_connection, run_db
+from singleflight import analytics_flight
 from utils import generate_qr_code_base64
 
 router = APIRouter()
@@ -85,43 +86,34 @@ ADMIN_HTML = """
 </html>
 """
 
-@router.get("/admin")
-async def admin_dashboard():
-    """統計管理画面"""
+def _render_admin_dashboard():
+    """管理画面を描画（分析用DBスレッドで実行）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # 総合統計
-        cursor.execute('''
-            SELECT 
-                COUNT(DISTINCT u.id) as total_urls,
-                COUNT(c.id) as total_clicks,
-                COUNT(DISTINCT c.ip_address) as unique_clicks,
-                COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks
-            FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
-            WHERE u.is_active = TRUE
-        ''')
-        
-        stats = cursor.fetchone()
-        total_urls, total_clicks, unique_clicks, qr_clicks = stats
-        
-        # URL一覧
-        cursor.execute('''
-            SELECT u.short_code, u.original_url, u.created_at, u.custom_name, u.campaign_name,
-                   COUNT(c.id) as click_count,
-                   COUNT(DISTINCT c.ip_address) as unique_clicks,
-                   COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks
-            FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
-            WHERE u.is_active = TRUE
-            GROUP BY u.id
-            ORDER BY u.created_at DESC
-        ''')
-        
-        results = cursor.fetchall()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # 総合統計（書き込み時に更新される global_stats を読むだけ）
+            cursor.execute('''
+                SELECT total_urls, total_clicks, unique_estimate, qr_clicks
+                FROM global_stats
+                WHERE id = 1
+            ''')
+            
+            total_urls, total_clicks, unique_clicks, qr_clicks = cursor.fetchone() or (0, 0, 0, 0)
+            
+            # URL一覧（全件を新しい順に。集計値は url_stats から）
+            cursor.execute('''
+                SELECT u.short_code, u.original_url, u.created_at, u.custom_name, u.campaign_name,
+                       IFNULL(s.click_count, 0) as click_count,
+                       IFNULL(s.unique_estimate, 0) as unique_clicks,
+                       IFNULL(s.qr_count, 0) as qr_clicks
+                FROM urls u
+                LEFT JOIN url_stats s ON u.id = s.url_id
+                WHERE u.is_active = TRUE
+                ORDER BY u.created_at DESC, u.id DESC
+            ''')
+            
+            results = cursor.fetchall()
         
         # テーブル行を生成
         table_rows = ""
@@ -160,3 +152,7 @@ async def admin_dashboard():
         error_html = f"<h1>Error</h1><p>{str(e)}</p>"
         return HTMLResponse(content=error_html, status_code=500)
 
+@router.get("/admin")
+async def admin_dashboard():
+    """統計管理画面（同時の表示要求は1回の描画を共有）"""
+    return await analytics_flight.do(('admin',), lambda: run_db("analytics", _render_admin_dashboard))
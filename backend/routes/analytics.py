@@ -1,9 +1,12 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import HTMLResponse
-import sqlite3
 from datetime import datetime, timedelta
 from typing import Dict, Any
-from config import DB_PATH, BASE_URL
+from config import BASE_URL
+from cache import url_cache, analytics_cache
+from singleflight import analytics_flight
+from database import get_db_connection, run_db
+from .redirect import _lookup_url
 
 router = APIRouter()
 
@@ -110,39 +113,32 @@ ANALYTICS_HTML = """<!DOCTYPE html>
 </body>
 </html>"""
 
-@router.get("/analytics/{short_code}")
-async def analytics_page(short_code: str):
-    """分析画面"""
+def _render_analytics_page(short_code: str):
+    """分析画面を描画（分析用DBスレッドで実行）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # URL情報取得
-        cursor.execute('''
-            SELECT original_url, created_at, custom_name, campaign_name
-            FROM urls WHERE short_code = ? AND is_active = TRUE
-        ''', (short_code,))
-        
-        result = cursor.fetchone()
-        if not result:
-            return HTMLResponse(content="<h1>エラー</h1><p>短縮URLが見つかりません</p>", status_code=404)
-        
-        original_url, created_at, custom_name, campaign_name = result
-        
-        # 統計情報取得
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_clicks,
-                COUNT(DISTINCT ip_address) as unique_clicks,
-                COUNT(CASE WHEN source = 'qr' THEN 1 END) as qr_clicks
-            FROM clicks 
-            WHERE url_id = (SELECT id FROM urls WHERE short_code = ?)
-        ''', (short_code,))
-        
-        stats = cursor.fetchone()
-        total_clicks, unique_clicks, qr_clicks = stats if stats else (0, 0, 0)
-        
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # URL情報取得
+            cursor.execute('''
+                SELECT id, original_url, created_at, custom_name, campaign_name
+                FROM urls WHERE short_code = ? AND is_active = TRUE
+            ''', (short_code,))
+            
+            result = cursor.fetchone()
+            if not result:
+                return HTMLResponse(content="<h1>エラー</h1><p>短縮URLが見つかりません</p>", status_code=404)
+            
+            url_id, original_url, created_at, custom_name, campaign_name = result
+            
+            # 統計情報取得（書き込み時に更新される url_stats から）
+            cursor.execute('''
+                SELECT click_count, unique_estimate, qr_count
+                FROM url_stats
+                WHERE url_id = ?
+            ''', (url_id,))
+            total_clicks, unique_clicks, qr_clicks = cursor.fetchone() or (0, 0, 0)
+            
         
         # HTMLをレンダリング
         html_content = ANALYTICS_HTML.format(
@@ -161,6 +157,25 @@ async def analytics_page(short_code: str):
         error_html = f"<h1>Error</h1><p>{str(e)}</p>"
         return HTMLResponse(content=error_html, status_code=500)
 
+@router.get("/analytics/{short_code}")
+async def analytics_page(short_code: str):
+    """分析画面（有効なリンクは分析キャッシュ経由）"""
+    cached = url_cache.get(short_code)
+    if cached is None:
+        cached = await run_db("redirect", _lookup_url, short_code)
+        url_cache.set(short_code, cached)
+    url_id, _, is_active = cached
+    if not is_active:
+        return HTMLResponse(content="<h1>エラー</h1><p>短縮URLが見つかりません</p>", status_code=404)
+    
+    return await analytics_cache.get_or_compute(
+        (short_code, 'page', 'all'), url_id,
+        lambda: analytics_flight.do(
+            ('page', short_code), lambda: run_db("analytics", _render_analytics_page, short_code)
+        ),
+        cacheable=lambda response: response.status_code == 200
+    )
+
 # 既存のAPIエンドポイントはそのまま保持
 async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
     """詳細な分析データを取得（API用）"""
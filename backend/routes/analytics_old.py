@@ -1,145 +1,192 @@
 from fastapi import APIRouter, HTTPException
-import sqlite3
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, Any
-from config import DB_PATH, BASE_URL
+from typing import Dict, Any, List, Tuple
+from config import BASE_URL
+from cache import url_cache, analytics_cache
+from singleflight import analytics_flight
+from analytics_executor import analytics_executor
+from columnar import aggregate_large_link
+from database import get_db_connection, run_db
+from rollups import dimension_value, merged_unique_visitors, recent_window, unique_visitors
+from .redirect import _lookup_url
 
 router = APIRouter()
 
 async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
-    """詳細な分析データを取得"""
+    """詳細な分析データを取得（有効なリンクは分析キャッシュ経由）"""
+    cached = url_cache.get(short_code)
+    if cached is None:
+        cached = await run_db("redirect", _lookup_url, short_code)
+        url_cache.set(short_code, cached)
+    url_id, _, is_active = cached
+    if not is_active:
+        raise HTTPException(status_code=404, detail="Short URL not found")
+    
+    return await analytics_cache.get_or_compute(
+        (short_code, 'detail', '30d'), url_id,
+        lambda: analytics_flight.do(
+            ('detail', short_code), lambda: analytics_executor.run(_compute_detailed_analytics, short_code)
+        )
+    )
+
+# 時間別集計表から読む明細キューブ（日付×直近30日フラグ×各ディメンション）
+ROLLUP_CUBE_SQL = '''
+    SELECT date(hour_bucket) AS day,
+           hour_bucket >= ? AS recent,
+           device_type, source, country, hour_of_day, day_of_week,
+           SUM(clicks) AS clicks
+    FROM click_rollup_dims
+    WHERE url_id = ?
+    GROUP BY day, recent, device_type, source, country, hour_of_day, day_of_week
+'''
+
+# 直近30日の開始時刻を含む時間枠のうち、範囲に入る部分だけを生のclicksから数える
+PARTIAL_HOUR_SQL = '''
+    SELECT date(created_at) AS day, COUNT(*), COUNT(CASE WHEN source = 'qr' THEN 1 END)
+    FROM clicks
+    WHERE url_id = ? AND created_at >= ? AND created_at < ?
+    GROUP BY day
+'''
+
+def _null_first(value: Any) -> tuple:
+    """SQLiteの並び順（NULLが先頭）と同じになるソートキー"""
+    return (value is not None, value if value is not None else '')
+
+def _ranked(counts: Dict[Any, int]) -> List[Tuple[Any, int]]:
+    """件数の降順（同数はキーの昇順）"""
+    return sorted(counts.items(), key=lambda kv: (-kv[1], _null_first(kv[0])))
+
+def _aggregate_cube(cube: List[tuple]) -> Dict[str, Any]:
+    """ROLLUP_CUBE_SQL の結果を集計（columnar.aggregate_columns と同じ形で返す）"""
+    total_clicks = 0
+    qr_clicks = 0
+    daily_totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    day_pairs: Dict[Any, Dict[tuple, int]] = defaultdict(lambda: defaultdict(int))
+    devices: Dict[Any, int] = defaultdict(int)
+    sources: Dict[Any, int] = defaultdict(int)
+    countries: Dict[Any, int] = defaultdict(int)
+    hourly_data = [0] * 24
+    weekly_data = [0] * 7
+    
+    for day, recent, device_type, source, country, hour, weekday, clicks in cube:
+        device_type, source, country, hour, weekday = map(
+            dimension_value, (device_type, source, country, hour, weekday)
+        )
+        is_qr = source == 'qr'
+        total_clicks += clicks
+        if is_qr:
+            qr_clicks += clicks
+        
+        # 時系列は直近30日のみ
+        if recent and day is not None:
+            daily_totals[day][0] += clicks
+            if is_qr:
+                daily_totals[day][1] += clicks
+        # 日別トップは日付単位（30日境界の日も1日分すべて）で判定
+        day_pairs[day][(device_type, source)] += clicks
+        
+        devices[device_type] += clicks
+        sources[source] += clicks
+        if country is not None and country != 'Unknown':
+            countries[country] += clicks
+        if hour is not None and 0 <= hour < 24:
+            hourly_data[hour] += clicks
+        if weekday is not None and 0 <= weekday < 7:
+            weekly_data[weekday] += clicks
+    
+    # その日に最も多いデバイス×参照元の組み合わせ
+    top_pairs = {
+        day: min(pairs.items(), key=lambda kv: (-kv[1], _null_first(kv[0][0]), _null_first(kv[0][1])))[0]
+        for day, pairs in day_pairs.items()
+    }
+    
+    return {
+        'total_clicks': total_clicks,
+        'qr_clicks': qr_clicks,
+        'daily': dict(daily_totals),
+        'top_pairs': top_pairs,
+        'devices': _ranked(devices),
+        'sources': _ranked(sources),
+        'countries': _ranked(countries),
+        'hourly': hourly_data,
+        'weekly': weekly_data
+    }
+
+def _compute_detailed_analytics(short_code: str) -> Dict[str, Any]:
+    """詳細な分析データを集計（分析用プロセスで実行）
+
+    クリック数は時間別集計表から、合計・日別・デバイス・参照元・地域・時間帯・
+    曜日・日別トップをまとめて集計する。集計行が ANALYTICS_COLUMNAR_MIN_ROWS
+    以上のリンクは columnar の列指向集計を使う（結果はキューブ集計と同一）。
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # 基本情報取得
-        cursor.execute('''
-            SELECT u.id, u.original_url, u.created_at, u.custom_name, u.campaign_name,
-                   COUNT(c.id) as total_clicks,
-                   COUNT(DISTINCT c.ip_address) as unique_clicks,
-                   COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks
-            FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
-            WHERE u.short_code = ? AND u.is_active = TRUE
-            GROUP BY u.id
-        ''', (short_code,))
-        
-        result = cursor.fetchone()
-        if not result:
-            raise HTTPException(status_code=404, detail="Short URL not found")
-        
-        url_id, original_url, created_at, custom_name, campaign_name, total_clicks, unique_clicks, qr_clicks = result
-        
-        # 時系列データ
-        cursor.execute('''
-            SELECT date(created_at) as date, COUNT(*) as clicks,
-                   COUNT(CASE WHEN source = 'qr' THEN 1 END) as qr_clicks
-            FROM clicks
-            WHERE url_id = ? AND created_at >= datetime('now', '-30 days')
-            GROUP BY date
-            ORDER BY date
-        ''', (url_id,))
-        
-        daily_data = cursor.fetchall()
-        
-        # デバイス別統計
-        cursor.execute('''
-            SELECT device_type, COUNT(*) as count
-            FROM clicks
-            WHERE url_id = ?
-            GROUP BY device_type
-            ORDER BY count DESC
-        ''', (url_id,))
-        
-        device_data = cursor.fetchall()
-        
-        # 参照元別統計
-        cursor.execute('''
-            SELECT source, COUNT(*) as count
-            FROM clicks
-            WHERE url_id = ?
-            GROUP BY source
-            ORDER BY count DESC
-        ''', (url_id,))
-        
-        source_data = cursor.fetchall()
-        
-        # 地域別統計
-        cursor.execute('''
-            SELECT country, COUNT(*) as count
-            FROM clicks
-            WHERE url_id = ? AND country != 'Unknown'
-            GROUP BY country
-            ORDER BY count DESC
-            LIMIT 10
-        ''', (url_id,))
-        
-        geo_data = cursor.fetchall()
-        
-        # 時間帯別統計
-        cursor.execute('''
-            SELECT hour_of_day, COUNT(*) as count
-            FROM clicks
-            WHERE url_id = ? AND hour_of_day IS NOT NULL
-            GROUP BY hour_of_day
-            ORDER BY hour_of_day
-        ''', (url_id,))
-        
-        hourly_data = [0] * 24
-        for hour, count in cursor.fetchall():
-            if 0 <= hour < 24:
-                hourly_data[hour] = count
-        
-        # 曜日別統計
-        cursor.execute('''
-            SELECT day_of_week, COUNT(*) as count
-            FROM clicks
-            WHERE url_id = ? AND day_of_week IS NOT NULL
-            GROUP BY day_of_week
-            ORDER BY day_of_week
-        ''', (url_id,))
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # 基本情報取得
+            cursor.execute('''
+                SELECT id, original_url, created_at, custom_name, campaign_name
+                FROM urls
+                WHERE short_code = ? AND is_active = TRUE
+            ''', (short_code,))
+            
+            result = cursor.fetchone()
+            if not result:
+                raise HTTPException(status_code=404, detail="Short URL not found")
+            
+            url_id, original_url, created_at, custom_name, campaign_name = result
+            
+            # 集計行の多いリンクはnumpyの列指向集計、それ以外はキューブをPythonで集計
+            window_start, next_bucket = recent_window(30)
+            aggregated = aggregate_large_link(conn, url_id, next_bucket)
+            if aggregated is None:
+                cursor.execute(ROLLUP_CUBE_SQL, (next_bucket, url_id))
+                aggregated = _aggregate_cube(cursor.fetchall())
+            cursor.execute(PARTIAL_HOUR_SQL, (url_id, window_start, next_bucket))
+            partial_hour = cursor.fetchall()
+            
+            unique_clicks = unique_visitors(conn, [url_id]).get(url_id, 0)
         
-        weekly_data = [0] * 7
-        for day, count in cursor.fetchall():
-            if 0 <= day < 7:
-                weekly_data[day] = count
+        # 境界の時間枠は合計には集計表から含め済みのため、時系列にだけ加える
+        daily_totals = aggregated['daily']
+        for day, clicks, day_qr_clicks in partial_hour:
+            totals = daily_totals.setdefault(day, [0, 0])
+            totals[0] += clicks
+            totals[1] += day_qr_clicks
         
-        conn.close()
+        total_clicks = aggregated['total_clicks']
+        qr_clicks = aggregated['qr_clicks']
+        hourly_data = aggregated['hourly']
+        weekly_data = aggregated['weekly']
         
         # チャート用データ整形
-        daily_labels = [str(row[0]) for row in daily_data]
-        daily_clicks = [row[1] for row in daily_data]
-        daily_qr_clicks = [row[2] for row in daily_data]
+        daily_data = sorted(daily_totals.items())
+        daily_labels = [str(day) for day, _ in daily_data]
+        daily_clicks = [counts[0] for _, counts in daily_data]
+        daily_qr_clicks = [counts[1] for _, counts in daily_data]
         
+        device_data = aggregated['devices']
         device_labels = [row[0] for row in device_data]
         device_counts = [row[1] for row in device_data]
         
+        source_data = aggregated['sources']
         source_labels = [row[0] for row in source_data]
         source_counts = [row[1] for row in source_data]
         
+        geo_data = aggregated['countries'][:10]
         geo_labels = [row[0] for row in geo_data]
         geo_counts = [row[1] for row in geo_data]
         
-        # 日別詳細データ
+        # 日別詳細データ（その日に最も多いデバイス×参照元の組み合わせ）
         daily_details = []
-        for date, clicks, qr_clicks in daily_data:
-            cursor.execute('''
-                SELECT device_type, source, COUNT(*) 
-                FROM clicks 
-                WHERE url_id = ? AND date(created_at) = ?
-                GROUP BY device_type, source 
-                ORDER BY COUNT(*) DESC 
-                LIMIT 1
-            ''', (url_id, date))
-            
-            top_result = cursor.fetchone()
-            top_device = top_result[0] if top_result else 'unknown'
-            top_source = top_result[1] if top_result else 'direct'
+        for day, (clicks, day_qr_clicks) in daily_data:
+            top_device, top_source = aggregated['top_pairs'].get(day, ('unknown', 'direct'))
             
             daily_details.append({
-                'date': date,
+                'date': day,
                 'clicks': clicks,
-                'qr_clicks': qr_clicks,
+                'qr_clicks': day_qr_clicks,
                 'top_device': top_device,
                 'top_source': top_source
             })
@@ -169,6 +216,8 @@ async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
             'daily_details': daily_details
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analytics failed: {str(e)}")
 
@@ -179,60 +228,81 @@ async def get_stats(short_code: str):
 
 @router.get("/analytics/campaign/{campaign_name}")
 async def get_campaign_analytics(campaign_name: str):
-    """キャンペーン別の分析データを取得"""
+    """キャンペーン別の分析データを取得（同時の同一リクエストは1回の集計を共有）"""
+    return await analytics_flight.do(
+        ('campaign', campaign_name), lambda: analytics_executor.run(_compute_campaign_analytics, campaign_name)
+    )
+
+def _compute_campaign_analytics(campaign_name: str) -> Dict[str, Any]:
+    """キャンペーン別の分析データを集計（分析用プロセスで実行）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # キャンペーンのURL一覧と統計
-        cursor.execute('''
-            SELECT u.short_code, u.original_url, u.custom_name,
-                   COUNT(c.id) as clicks,
-                   COUNT(DISTINCT c.ip_address) as unique_visitors,
-                   COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks
-            FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
-            WHERE u.campaign_name = ? AND u.is_active = TRUE
-            GROUP BY u.id
-            ORDER BY clicks DESC
-        ''', (campaign_name,))
-        
-        urls_data = cursor.fetchall()
-        
-        if not urls_data:
-            raise HTTPException(status_code=404, detail="Campaign not found")
-        
-        # 総計算
-        total_clicks = sum(row[3] for row in urls_data)
-        total_unique = sum(row[4] for row in urls_data)
-        total_qr = sum(row[5] for row in urls_data)
-        
-        # 時系列データ
-        cursor.execute('''
-            SELECT date(c.created_at) as date, COUNT(*) as clicks
-            FROM clicks c
-            JOIN urls u ON c.url_id = u.id
-            WHERE u.campaign_name = ?
-            AND c.created_at >= datetime('now', '-30 days')
-            GROUP BY date
-            ORDER BY date
-        ''', (campaign_name,))
-        
-        daily_data = cursor.fetchall()
-        
-        # デバイス別統計
-        cursor.execute('''
-            SELECT c.device_type, COUNT(*) as count
-            FROM clicks c
-            JOIN urls u ON c.url_id = u.id
-            WHERE u.campaign_name = ?
-            GROUP BY c.device_type
-            ORDER BY count DESC
-        ''', (campaign_name,))
-        
-        device_data = cursor.fetchall()
-        
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # キャンペーンのURL一覧と統計（クリック数は時間別集計表から）
+            cursor.execute('''
+                SELECT u.id, u.short_code, u.original_url, u.custom_name,
+                       IFNULL(SUM(r.clicks), 0) as clicks,
+                       IFNULL(SUM(r.qr_clicks), 0) as qr_clicks
+                FROM urls u
+                LEFT JOIN click_rollup_hourly r ON u.id = r.url_id
+                WHERE u.campaign_name = ? AND u.is_active = TRUE
+                GROUP BY u.id
+                ORDER BY clicks DESC
+            ''', (campaign_name,))
+            
+            url_rows = cursor.fetchall()
+            
+            if not url_rows:
+                raise HTTPException(status_code=404, detail="Campaign not found")
+            
+            # ユニーク訪問者はスケッチから推定（合計は複数リンクを訪れた人を1人として数える）
+            url_ids = [row[0] for row in url_rows]
+            visitors = unique_visitors(conn, url_ids)
+            total_unique = merged_unique_visitors(conn, url_ids)
+            
+            urls_data = [
+                (short_code, original_url, custom_name, clicks, visitors.get(url_id, 0), qr)
+                for url_id, short_code, original_url, custom_name, clicks, qr in url_rows
+            ]
+            
+            # 総計算
+            total_clicks = sum(row[3] for row in urls_data)
+            total_qr = sum(row[5] for row in urls_data)
+            
+            # 時系列データ（開始時刻を含む時間枠だけ生のclicksから数える）
+            window_start, next_bucket = recent_window(30)
+            cursor.execute('''
+                SELECT date, SUM(clicks) FROM (
+                    SELECT date(r.hour_bucket) as date, r.clicks
+                    FROM click_rollup_hourly r
+                    JOIN urls u ON r.url_id = u.id
+                    WHERE u.campaign_name = ? AND r.hour_bucket >= ?
+                    UNION ALL
+                    SELECT date(c.created_at) as date, 1
+                    FROM clicks c
+                    JOIN urls u ON c.url_id = u.id
+                    WHERE u.campaign_name = ?
+                    AND c.created_at >= ? AND c.created_at < ?
+                )
+                GROUP BY date
+                ORDER BY date
+            ''', (campaign_name, next_bucket, campaign_name, window_start, next_bucket))
+            
+            daily_data = cursor.fetchall()
+            
+            # デバイス別統計
+            cursor.execute('''
+                SELECT r.device_type, SUM(r.clicks) as count
+                FROM click_rollup_dims r
+                JOIN urls u ON r.url_id = u.id
+                WHERE u.campaign_name = ?
+                GROUP BY r.device_type
+                ORDER BY count DESC
+            ''', (campaign_name,))
+            
+            device_data = [(dimension_value(device), count) for device, count in cursor.fetchall()]
+            
         
         return {
             "campaign_name": campaign_name,
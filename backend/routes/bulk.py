@@ -1,10 +1,16 @@
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import HTMLResponse
-import sqlite3
-from typing import List, Dict, Any
+from fastapi.responses import HTMLResponse, StreamingResponse
+import asyncio
+import base64
+import json
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
 from models import BulkGenerationRequest, BulkGenerationItem
-from config import DB_PATH, BASE_URL
-from utils import generate_short_code, generate_qr_code_base64
+from config import BASE_URL, BULK_JOB_THRESHOLD, BULK_CHUNK_SIZE, BULK_STREAM_BUFFER_SIZE
+from database import db_writer, run_db
+from cache import url_cache
+from bulk_insert import insert_bulk_items
+from qr_cache import qr_cache
 
 router = APIRouter()
 
@@ -114,6 +120,8 @@ BULK_HTML = """
     </div>
 
     <script>
+        const BULK_JOB_THRESHOLD = __BULK_JOB_THRESHOLD__;
+        const JOB_RESULTS_PAGE_SIZE = 1000;
         let rowCounter = 1;
         
         function addRow() {
@@ -247,8 +255,21 @@ BULK_HTML = """
             resultsSection.style.display = 'block';
             resultsContent.innerHTML = '<div class="loading"><div class="spinner"></div><p>リンクを生成しています...</p></div>';
             
+            // 大量の場合はバックグラウンドジョブで生成して進捗を表示
+            if (data.length > BULK_JOB_THRESHOLD) {
+                try {
+                    await runBulkJob(data);
+                } catch (error) {
+                    resultsContent.innerHTML = `<div class="error-item">エラー: ${error.message}</div>`;
+                } finally {
+                    btn.disabled = false;
+                    btn.innerHTML = '🚀 一括生成開始';
+                }
+                return;
+            }
+            
             try {
-                const response = await fetch('/bulk-generate', {
+                const response = await fetch('/bulk-generate?stream=true&include_qr=false', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json'
@@ -260,8 +281,7 @@ BULK_HTML = """
                     throw new Error(`HTTP error! status: ${response.status}`);
                 }
                 
-                const result = await response.json();
-                displayResults(result);
+                await displayStream(response, data.length);
                 
             } catch (error) {
                 resultsContent.innerHTML = `<div class="error-item">エラー: ${error.message}</div>`;
@@ -271,6 +291,151 @@ BULK_HTML = """
             }
         }
         
+        async function displayStream(response, total) {
+            // NDJSONを1行ずつ読み、登録されたリンクから順に表示
+            const resultsContent = document.getElementById('resultsContent');
+            resultsContent.innerHTML = `
+                <div style="background: #e3f2fd; padding: 15px; border-radius: 5px; margin-bottom: 20px;">
+                    <h3>📊 生成サマリー</h3>
+                    <p id="streamSummary">生成中... 0 / ${total}</p>
+                </div>
+                <h3>✅ 生成成功</h3>
+                <div id="streamResults"></div>
+                <h3>❌ エラー</h3>
+                <div id="streamErrors"></div>
+            `;
+            const summary = document.getElementById('streamSummary');
+            const resultsList = document.getElementById('streamResults');
+            const errorsList = document.getElementById('streamErrors');
+            
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = '';
+            let successCount = 0;
+            let errorCount = 0;
+            
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\\n');
+                buffered = lines.pop();
+                
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const message = JSON.parse(line);
+                    if (message.type === 'result') {
+                        resultsList.insertAdjacentHTML('beforeend', resultItemHtml(message, successCount));
+                        successCount++;
+                    } else if (message.type === 'error') {
+                        errorsList.insertAdjacentHTML('beforeend', errorItemHtml(message));
+                        errorCount++;
+                    } else if (message.type === 'failed') {
+                        throw new Error(message.error);
+                    }
+                    summary.innerHTML = `${message.type === 'summary' ? '完了' : '生成中...'} 成功: <strong>${successCount}</strong> | エラー: <strong>${errorCount}</strong> | ${successCount + errorCount} / ${total}`;
+                }
+            }
+        }
+        
+        async function runBulkJob(data) {
+            const resultsContent = document.getElementById('resultsContent');
+            
+            const response = await fetch('/api/jobs/bulk-generate', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ items: data })
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            let job = await response.json();
+            
+            // 完了するまで進捗をポーリング
+            while (job.status === 'queued' || job.status === 'running') {
+                const percent = Math.floor(job.progress * 100);
+                resultsContent.innerHTML = `
+                    <div class="loading">
+                        <p>リンクを生成しています... ${job.processed_items} / ${job.total_items} (${percent}%)</p>
+                        <div style="background: #eee; border-radius: 5px; height: 20px;">
+                            <div style="background: #4CAF50; width: ${percent}%; height: 20px; border-radius: 5px;"></div>
+                        </div>
+                        <small>ジョブID: ${job.job_id}（このページを閉じても生成は続きます）</small>
+                    </div>
+                `;
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                const statusResponse = await fetch(`/api/jobs/${job.job_id}`);
+                if (!statusResponse.ok) {
+                    throw new Error(`HTTP error! status: ${statusResponse.status}`);
+                }
+                job = await statusResponse.json();
+            }
+            
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'ジョブが失敗しました');
+            }
+            
+            // 結果の先頭ページを表示（全件はAPIから取得）
+            const resultsResponse = await fetch(`/api/jobs/${job.job_id}/results?limit=${JOB_RESULTS_PAGE_SIZE}`);
+            if (!resultsResponse.ok) {
+                throw new Error(`HTTP error! status: ${resultsResponse.status}`);
+            }
+            const page = await resultsResponse.json();
+            const result = { success_count: job.success_count, error_count: job.error_count, results: [], errors: [] };
+            page.results.forEach(item => {
+                if (item.error) {
+                    result.errors.push({ original_url: item.original_url, error: item.error });
+                } else {
+                    result.results.push({
+                        original_url: item.original_url,
+                        custom_name: item.custom_name,
+                        campaign_name: item.campaign_name,
+                        generated_urls: [{ short_code: item.short_code, short_url: item.short_url, qr_url: item.qr_url }]
+                    });
+                }
+            });
+            displayResults(result);
+            
+            if (page.next_offset !== null) {
+                resultsContent.insertAdjacentHTML('afterbegin', `
+                    <div class="instructions">
+                        最初の ${JOB_RESULTS_PAGE_SIZE} 件を表示しています。全件は
+                        <a href="${job.results_url}" target="_blank">結果API</a> から取得できます。
+                    </div>
+                `);
+            }
+        }
+        
+        function resultItemHtml(item, index) {
+            let html = `
+                <div class="result-item">
+                    <p><strong>${index + 1}. 元URL:</strong> ${item.original_url}</p>
+                    <p><strong>カスタム名:</strong> ${item.custom_name || 'なし'} | <strong>キャンペーン:</strong> ${item.campaign_name || 'なし'}</p>
+                    <p><strong>生成されたリンク:</strong></p>
+            `;
+            
+            item.generated_urls.forEach((url, urlIndex) => {
+                html += `
+                    <div style="margin: 10px 0; padding: 10px; background: white; border-radius: 5px;">
+                        <strong>${url.short_code}</strong>: 
+                        <a href="${url.short_url}" target="_blank">${url.short_url}</a>
+                        <button class="copy-btn" onclick="copyToClipboard('${url.short_url}')">📋 コピー</button>
+                        <a href="/analytics/${url.short_code}" target="_blank" class="stats-link">📈 分析</a>
+                        <br>
+                        <small>QR: <a href="${url.qr_url}" target="_blank">${url.qr_url}</a></small>
+                    </div>
+                `;
+            });
+            
+            return html + '</div>';
+        }
+        
+        function errorItemHtml(error) {
+            return `<div class="error-item">URL: ${error.original_url} - エラー: ${error.error}</div>`;
+        }
+        
         function displayResults(result) {
             const resultsContent = document.getElementById('resultsContent');
             
@@ -284,34 +449,14 @@ BULK_HTML = """
             if (result.results && result.results.length > 0) {
                 html += '<h3>✅ 生成成功</h3>';
                 result.results.forEach((item, index) => {
-                    html += `
-                        <div class="result-item">
-                            <p><strong>${index + 1}. 元URL:</strong> ${item.original_url}</p>
-                            <p><strong>カスタム名:</strong> ${item.custom_name || 'なし'} | <strong>キャンペーン:</strong> ${item.campaign_name || 'なし'}</p>
-                            <p><strong>生成されたリンク:</strong></p>
-                    `;
-                    
-                    item.generated_urls.forEach((url, urlIndex) => {
-                        html += `
-                            <div style="margin: 10px 0; padding: 10px; background: white; border-radius: 5px;">
-                                <strong>${url.short_code}</strong>: 
-                                <a href="${url.short_url}" target="_blank">${url.short_url}</a>
-                                <button class="copy-btn" onclick="copyToClipboard('${url.short_url}')">📋 コピー</button>
-                                <a href="/analytics/${url.short_code}" target="_blank" class="stats-link">📈 分析</a>
-                                <br>
-                                <small>QR: <a href="${url.qr_url}" target="_blank">${url.qr_url}</a></small>
-                            </div>
-                        `;
-                    });
-                    
-                    html += '</div>';
+                    html += resultItemHtml(item, index);
                 });
             }
             
             if (result.errors && result.errors.length > 0) {
                 html += '<h3>❌ エラー</h3>';
                 result.errors.forEach(error => {
-                    html += `<div class="error-item">URL: ${error.original_url} - エラー: ${error.error}</div>`;
+                    html += errorItemHtml(error);
                 });
             }
             
@@ -363,71 +508,92 @@ BULK_HTML = """
 @router.get("/bulk")
 async def bulk_generation_page():
     """一括生成ページ"""
-    return HTMLResponse(content=BULK_HTML)
+    return HTMLResponse(content=BULK_HTML.replace("__BULK_JOB_THRESHOLD__", str(BULK_JOB_THRESHOLD)))
 
-@router.post("/bulk-generate")
-async def bulk_generate_urls(request: BulkGenerationRequest):
-    """複数URLを一括生成"""
+def _build_result(item: BulkGenerationItem, short_code: str, created_at: str,
+                  qr_code_base64: Optional[str]) -> Dict[str, Any]:
+    """作成したリンクの結果"""
+    # 作成したコードのキャッシュ（未登録として保存されたもの）を無効化
+    url_cache.invalidate(short_code)
+    
+    # URL生成
+    short_url = f"{BASE_URL}/{short_code}"
+    qr_url = f"{BASE_URL}/{short_code}?source=qr"
+    
+    return {
+        "original_url": item.original_url,
+        "custom_slug": item.custom_slug,
+        "custom_name": item.custom_name,
+        "campaign_name": item.campaign_name,
+        "generated_urls": [{
+            "short_code": short_code,
+            "short_url": short_url,
+            "qr_url": qr_url,
+            "qr_image_url": f"{BASE_URL}/api/qr/{short_code}",
+            "qr_code_base64": qr_code_base64,
+            "created_at": created_at
+        }]
+    }
+
+def _generate_in_chunks(items: List[BulkGenerationItem], include_qr: bool,
+                        should_continue: Callable[[], bool] = lambda: True,
+                        prefetch: Callable[[], bool] = lambda: True) -> Iterator[tuple]:
+    """チャンクごとに登録してQRを描画する
+
+    次のチャンクのINSERTをライターに投入してから現在のチャンクのQRを
+    プロセスプールで描画するため、DB書き込みとQR描画が並行して進む。
+    (offset, chunk, created_at, outcomes, qr_images) を順に返す。
+    prefetch() が偽の間は先行投入せず、呼び出し側が現在のチャンクを処理し
+    終えてから次を投入する。should_continue() が偽になったら次のチャンクは
+    投入せず、途中で閉じられた場合は先行投入済みのチャンクを取り消す
+    （書き込み開始済みなら完了を待つ）。
+    """
+    chunks = [items[offset:offset + BULK_CHUNK_SIZE] for offset in range(0, len(items), BULK_CHUNK_SIZE)]
+    pending = db_writer.submit(insert_bulk_items, chunks[0]) if chunks else None
+    
+    try:
+        for i, chunk in enumerate(chunks):
+            current, pending = pending, None
+            created_at, outcomes = current.result()
+            has_next = i + 1 < len(chunks)
+            if has_next and should_continue() and prefetch():
+                pending = db_writer.submit(insert_bulk_items, chunks[i + 1])
+            
+            qr_images: Dict[str, Optional[str]] = {}
+            if include_qr:
+                codes = [short_code for short_code, _ in outcomes if short_code]
+                entries = qr_cache.get_many([f"{BASE_URL}/{short_code}?source=qr" for short_code in codes])
+                qr_images = {
+                    short_code: base64.b64encode(entry[0]).decode('utf-8') if entry else None
+                    for short_code, entry in zip(codes, entries)
+                }
+            
+            yield i * BULK_CHUNK_SIZE, chunk, created_at, outcomes, qr_images
+            if pending is None and has_next:
+                if not should_continue():
+                    return
+                pending = db_writer.submit(insert_bulk_items, chunks[i + 1])
+    finally:
+        if pending is not None and not pending.cancel() and pending.exception() is None:
+            _, outcomes = pending.result()
+            created = sum(1 for short_code, _ in outcomes if short_code)
+            print(f"⚠️  Bulk chunk committed after the consumer stopped: {created} links not reported")
+
+def _bulk_generate_urls(request: BulkGenerationRequest, include_qr: bool = True):
+    """一括生成処理（DB書き込みスレッドで実行）"""
     results = []
     errors = []
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        for item in request.items:
-            try:
-                # カスタムスラッグのチェック
-                short_code = item.custom_slug
-                if short_code:
-                    cursor.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,))
-                    if cursor.fetchone():
-                        raise HTTPException(status_code=400, detail=f"Custom slug '{short_code}' already exists")
-                else:
-                    short_code = generate_short_code(conn=conn)
-                
-                # URLを保存
-                cursor.execute('''
-                    INSERT INTO urls (short_code, original_url, custom_name, campaign_name, created_by) 
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (short_code, item.original_url, item.custom_name, item.campaign_name, 'bulk_api'))
-                
-                # 作成時刻取得
-                cursor.execute("SELECT created_at FROM urls WHERE short_code = ?", (short_code,))
-                created_at = cursor.fetchone()[0]
-                
-                # URL生成
-                short_url = f"{BASE_URL}/{short_code}"
-                qr_url = f"{BASE_URL}/{short_code}?source=qr"
-                qr_code_base64 = generate_qr_code_base64(qr_url)
-                
-                results.append({
-                    "original_url": item.original_url,
-                    "custom_slug": item.custom_slug,
-                    "custom_name": item.custom_name,
-                    "campaign_name": item.campaign_name,
-                    "generated_urls": [{
-                        "short_code": short_code,
-                        "short_url": short_url,
-                        "qr_url": qr_url,
-                        "qr_code_base64": qr_code_base64,
-                        "created_at": created_at
-                    }]
-                })
-                
-            except HTTPException as he:
-                errors.append({
-                    "original_url": item.original_url,
-                    "error": he.detail
-                })
-            except Exception as e:
-                errors.append({
-                    "original_url": item.original_url,
-                    "error": str(e)
-                })
-        
-        conn.commit()
-        conn.close()
+        for _, chunk, created_at, outcomes, qr_images in _generate_in_chunks(request.items, include_qr):
+            for item, (short_code, error) in zip(chunk, outcomes):
+                if error:
+                    errors.append({
+                        "original_url": item.original_url,
+                        "error": error
+                    })
+                    continue
+                results.append(_build_result(item, short_code, created_at, qr_images.get(short_code)))
         
         return {
             "success_count": len(results),
@@ -437,4 +603,92 @@ async def bulk_generate_urls(request: BulkGenerationRequest):
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Bulk generation failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Bulk generation failed: {str(e)}")
+
+class _StreamClosed(Exception):
+    """クライアントが切断した"""
+
+def _produce_bulk_stream(items: List[BulkGenerationItem], include_qr: bool,
+                         emit: Callable[[Dict[str, Any]], None], should_continue: Callable[[], bool],
+                         prefetch: Callable[[], bool]) -> None:
+    """チャンクごとに登録し、コミットした行から順に emit（ストリーム送信スレッドで実行）
+
+    emit が _StreamClosed を送出したら（クライアント切断）、以降のチャンクは登録しない。
+    prefetch() はクライアントが受信に追いついているか（次のチャンクを先行投入してよいか）。
+    """
+    success_count = 0
+    error_count = 0
+    chunks = _generate_in_chunks(items, include_qr, should_continue, prefetch)
+    
+    try:
+        for offset, chunk, created_at, outcomes, qr_images in chunks:
+            for index, (item, (short_code, error)) in enumerate(zip(chunk, outcomes), start=offset):
+                if error:
+                    error_count += 1
+                    emit({"type": "error", "index": index, "original_url": item.original_url, "error": error})
+                else:
+                    success_count += 1
+                    emit({"type": "result", "index": index,
+                          **_build_result(item, short_code, created_at, qr_images.get(short_code))})
+        
+        emit({"type": "summary", "success_count": success_count, "error_count": error_count})
+    except _StreamClosed:
+        print(f"⚠️  Bulk stream closed by client after {success_count + error_count} items")
+    except Exception as e:
+        try:
+            emit({"type": "failed", "error": f"Bulk generation failed: {str(e)}"})
+        except _StreamClosed:
+            # 切断後の失敗は送る先がないためログだけ残す
+            print(f"⚠️  Bulk stream failed after the client disconnected: {e}")
+    finally:
+        chunks.close()
+
+async def _stream_bulk_generation(items: List[BulkGenerationItem], include_qr: bool) -> AsyncIterator[bytes]:
+    """NDJSONで1リンク1行を返す（有限バッファで生成側に背圧をかける）"""
+    loop = asyncio.get_running_loop()
+    buffer: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=BULK_STREAM_BUFFER_SIZE)
+    closed = threading.Event()
+    receiving = threading.Event()
+    
+    def emit(message: Dict[str, Any]) -> None:
+        if closed.is_set():
+            raise _StreamClosed()
+        line = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+        # バッファが満杯なら空くまで生成スレッドを止める
+        asyncio.run_coroutine_threadsafe(buffer.put(line), loop).result()
+    
+    def produce() -> None:
+        try:
+            # クライアントが受信を始め、送信待ちの行が無い（背圧がかかっていない）ときだけ先行投入する
+            _produce_bulk_stream(items, include_qr, emit, lambda: not closed.is_set(),
+                                 lambda: receiving.is_set() and buffer.empty())
+        finally:
+            if not closed.is_set():
+                asyncio.run_coroutine_threadsafe(buffer.put(None), loop).result()
+    
+    # 送信待ちで止まるため書き込み用スレッドは使わない（登録自体は db_writer が行う）
+    producer = asyncio.ensure_future(run_db("stream", produce))
+    try:
+        while True:
+            line = await buffer.get()
+            if line is None:
+                break
+            yield line
+            receiving.set()
+        await producer
+    finally:
+        # 切断時は生成側を止め、待機中の put を解放する
+        closed.set()
+        while not buffer.empty():
+            buffer.get_nowait()
+
+@router.post("/bulk-generate")
+async def bulk_generate_urls(request: BulkGenerationRequest, stream: bool = False, include_qr: bool = True):
+    """複数URLを一括生成
+
+    stream=trueで1リンク1行のNDJSONを逐次返す。include_qr=falseの場合は
+    QR画像を埋め込まず、qr_image_url から必要な時に取得してもらう。
+    """
+    if stream:
+        return StreamingResponse(_stream_bulk_generation(request.items, include_qr), media_type="application/x-ndjson")
+    return await run_db("write", _bulk_generate_urls, request, include_qr)
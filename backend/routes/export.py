@@ -1,40 +1,43 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import Response
-import sqlite3
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
 import csv
 import io
+import tempfile
+import zipfile
 from datetime import datetime
-from config import DB_PATH
+from typing import AsyncIterator, Iterator, List
+from urllib.parse import quote
+from config import BASE_URL, QR_AVAILABLE, QR_EXPORT_BATCH_SIZE
+from database import get_db_connection, run_db
+from qr_cache import qr_cache
 
 router = APIRouter()
 
-@router.get("/export/csv/{short_code}")
-async def export_clicks_csv(short_code: str):
-    """クリックデータをCSVでエクスポート"""
+def _export_clicks_csv(short_code: str):
+    """CSVを作成（分析用DBスレッドで実行）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # URL存在確認
-        cursor.execute("SELECT id, original_url FROM urls WHERE short_code = ?", (short_code,))
-        url_info = cursor.fetchone()
-        if not url_info:
-            raise HTTPException(status_code=404, detail="Short URL not found")
-        
-        url_id = url_info[0]
-        
-        # クリックデータ取得
-        cursor.execute('''
-            SELECT created_at, ip_address, country, region, city, 
-                   device_type, browser, os, source, referrer,
-                   utm_source, utm_medium, utm_campaign
-            FROM clicks 
-            WHERE url_id = ? 
-            ORDER BY created_at DESC
-        ''', (url_id,))
-        
-        clicks_data = cursor.fetchall()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # URL存在確認
+            cursor.execute("SELECT id, original_url FROM urls WHERE short_code = ?", (short_code,))
+            url_info = cursor.fetchone()
+            if not url_info:
+                raise HTTPException(status_code=404, detail="Short URL not found")
+            
+            url_id = url_info[0]
+            
+            # クリックデータ取得
+            cursor.execute('''
+                SELECT created_at, ip_address, country, region, city, 
+                       device_type, browser, os, source, referrer,
+                       utm_source, utm_medium, utm_campaign
+                FROM clicks 
+                WHERE url_id = ? 
+                ORDER BY created_at DESC
+            ''', (url_id,))
+            
+            clicks_data = cursor.fetchall()
         
         # CSVデータ作成
         output = io.StringIO()
@@ -68,4 +71,127 @@ async def export_clicks_csv(short_code: str):
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"CSV export failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"CSV export failed: {str(e)}")
+
+@router.get("/export/csv/{short_code}")
+async def export_clicks_csv(short_code: str):
+    """クリックデータをCSVでエクスポート"""
+    return await run_db("analytics", _export_clicks_csv, short_code)
+
+class _ZipStream(io.RawIOBase):
+    """ZipFileの出力を溜め、呼び出し側が少しずつ取り出すための書き込み先
+
+    seekできないため、ZipFileはデータディスクリプタ付きで逐次書き出す。
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _campaign_url_batches(campaign_name: str) -> Iterator[list]:
+    """キャンペーンの有効なURLをid順にバッチで取得（バッチごとに接続を返却）"""
+    last_id = 0
+    while True:
+        with get_db_connection() as conn:
+            rows = conn.execute('''
+                SELECT id, short_code, original_url, custom_name, created_at
+                FROM urls
+                WHERE campaign_name = ? AND is_active = 1 AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (campaign_name, last_id, QR_EXPORT_BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def _has_campaign_urls(campaign_name: str) -> bool:
+    with get_db_connection() as conn:
+        return conn.execute(
+            "SELECT 1 FROM urls WHERE campaign_name = ? AND is_active = 1 LIMIT 1", (campaign_name,)
+        ).fetchone() is not None
+
+def _campaign_qr_zip(campaign_name: str, size: int, fmt: str) -> Iterator[bytes]:
+    """QR画像とCSVマニフェストのZIPをバッチごとに書き出す
+
+    画像はQRキャッシュから取得し、未キャッシュ分はバッチ単位で並列描画する。
+    マニフェストは一定サイズを超えると一時ファイルへ退避するため、
+    リンク数によらずメモリ使用量は一定。
+    """
+    stream = _ZipStream()
+    # PNGは圧縮済みのため無圧縮で格納
+    compress_type = zipfile.ZIP_STORED if fmt == 'png' else zipfile.ZIP_DEFLATED
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+', encoding='utf-8', newline='') as manifest:
+        writer = csv.writer(manifest)
+        writer.writerow(['File', 'Short_Code', 'Short_URL', 'QR_URL', 'Original_URL', 'Custom_Name', 'Created_At'])
+        
+        with zipfile.ZipFile(stream, mode='w') as archive:
+            for rows in _campaign_url_batches(campaign_name):
+                qr_urls = [f"{BASE_URL}/{row[1]}?source=qr" for row in rows]
+                entries = qr_cache.get_many(qr_urls, size, fmt)
+                
+                for (_, short_code, original_url, custom_name, created_at), qr_url, entry in zip(rows, qr_urls, entries):
+                    filename = f"{short_code}.{fmt}" if entry else ''
+                    if entry:
+                        archive.writestr(filename, entry[0], compress_type=compress_type)
+                    writer.writerow([filename, short_code, f"{BASE_URL}/{short_code}", qr_url,
+                                     original_url, custom_name or '', created_at])
+                yield stream.take()
+            
+            manifest.seek(0)
+            info = zipfile.ZipInfo('manifest.csv', date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, mode='w') as dest:
+                # Excelで文字化けしないようBOMを付ける
+                dest.write('\ufeff'.encode('utf-8'))
+                while True:
+                    chunk = manifest.read(64 * 1024)
+                    if not chunk:
+                        break
+                    dest.write(chunk.encode('utf-8'))
+                    yield stream.take()
+    
+    yield stream.take()
+
+async def _stream_campaign_qr_zip(campaign_name: str, size: int, fmt: str) -> AsyncIterator[bytes]:
+    """ZIPの各バッチ（DB読み込み・QR取得・書き出し）をストリーム用DBスレッドで1つずつ進める"""
+    chunks = _campaign_qr_zip(campaign_name, size, fmt)
+    try:
+        while True:
+            chunk = await run_db("stream", next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        # 切断時も一時ファイルとZIPを閉じる
+        await run_db("stream", chunks.close)
+
+@router.get("/export/qr-zip/{campaign_name}")
+async def export_campaign_qr_zip(campaign_name: str,
+                                 size: int = Query(600, ge=50, le=2000),
+                                 fmt: str = Query('png', alias='format', pattern='^(png|svg)$')):
+    """キャンペーン内の全QRコードとマニフェストをZIPでストリーミング"""
+    if not QR_AVAILABLE:
+        raise HTTPException(status_code=500, detail="QR code generation not available")
+    if not await run_db("analytics", _has_campaign_urls, campaign_name):
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    
+    filename = f"qr_{campaign_name}_{datetime.now().strftime('%Y%m%d')}.zip"
+    return StreamingResponse(
+        _stream_campaign_qr_zip(campaign_name, size, fmt),
+        media_type='application/zip',
+        headers={
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"
+        }
+    )
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, HTTPException, Query
+from models import BulkGenerationRequest
+from database import run_db
+from jobs import bulk_jobs
+
+router = APIRouter()
+
+@router.post("/jobs/bulk-generate", status_code=202)
+async def create_bulk_job(request: BulkGenerationRequest):
+    """一括生成ジョブを登録（ジョブIDをすぐに返す）"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to generate")
+    try:
+        return await run_db("write", bulk_jobs.submit, request.items)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create bulk job: {str(e)}")
+
+@router.get("/jobs/{job_id}")
+async def get_bulk_job(job_id: str):
+    """ジョブの進捗を取得"""
+    job = await run_db("analytics", bulk_jobs.status, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}/results")
+async def get_bulk_job_results(job_id: str,
+                               offset: int = Query(0, ge=0),
+                               limit: int = Query(100, ge=1, le=1000)):
+    """ジョブの結果をページ単位で取得"""
+    job = await run_db("analytics", bulk_jobs.status, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    results = await run_db("analytics", bulk_jobs.results, job_id, offset, limit)
+    next_offset = results[-1]["index"] + 1 if len(results) == limit else None
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "offset": offset,
+        "limit": limit,
+        "next_offset": next_offset,
+        "results": results
+    }
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+from config import BASE_URL, QR_AVAILABLE
+from database import run_db
+from cache import url_cache
+from qr_cache import qr_cache, QR_FORMATS
+from .redirect import _lookup_url
+
+router = APIRouter()
+
+@router.get("/qr/{short_code}")
+async def get_qr_code(short_code: str, request: Request,
+                      size: int = Query(200, ge=50, le=1000),
+                      fmt: str = Query('png', alias='format', pattern='^(png|svg)$')):
+    """短縮URLのQRコード画像（PNG/SVG、キャッシュ済みの画像を強いETag付きで返す）"""
+    if not QR_AVAILABLE:
+        raise HTTPException(status_code=500, detail="QR code generation not available")
+    
+    cached = url_cache.get(short_code)
+    if cached is None:
+        cached = await run_db("redirect", _lookup_url, short_code)
+        url_cache.set(short_code, cached)
+    if not cached[2]:
+        raise HTTPException(status_code=404, detail="Short URL not found")
+    
+    qr_url = f"{BASE_URL}/{short_code}?source=qr"
+    try:
+        entry = await run_db("qr", qr_cache.get, qr_url, size, fmt)
+    except Exception as e:
+        print(f"QR code generation error: {e}")
+        raise HTTPException(status_code=500, detail="QR code generation failed")
+    if entry is None:
+        raise HTTPException(status_code=500, detail="QR code generation failed")
+    
+    content, etag = entry
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "public, max-age=86400"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if f'"{etag}"' in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=QR_FORMATS[fmt], headers=headers)
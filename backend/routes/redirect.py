@@ -1,9 +1,10 @@
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import RedirectResponse
-import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
-from config import DB_PATH
+from database import get_redirect_connection, run_db
+from cache import url_cache
+from click_writer import click_writer
 from utils import get_location_info, parse_user_agent, parse_utm_parameters
 
 router = APIRouter()
@@ -11,6 +12,18 @@ router = APIRouter()
 # 除外するパスのリスト
 EXCLUDED_PATHS = {'admin', 'bulk', 'docs', 'health', 'analytics', 'api', 'favicon.ico'}
 
+def _lookup_url(short_code: str) -> tuple:
+    """短縮コードを解決（リダイレクト用DBスレッドで実行）"""
+    with get_redirect_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, original_url, is_active FROM urls WHERE short_code = ?",
+            (short_code,)
+        )
+        result = cursor.fetchone()
+    
+    return (result[0], result[1], bool(result[2])) if result else (None, None, False)
+
 @router.get("/{short_code}")
 async def redirect_url(short_code: str, request: Request, source: Optional[str] = None):
     """リダイレクト処理"""
@@ -22,21 +35,17 @@ async def redirect_url(short_code: str, request: Request, source: Optional[str]
     print(f"🔍 Looking for short_code: '{short_code}'")
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # URL取得
-        cursor.execute(
-            "SELECT id, original_url FROM urls WHERE short_code = ? AND is_active = TRUE",
-            (short_code,)
-        )
-        result = cursor.fetchone()
+        # URL取得（キャッシュ優先）
+        cached = url_cache.get(short_code)
+        if cached is None:
+            cached = await run_db("redirect", _lookup_url, short_code)
+            url_cache.set(short_code, cached)
         
-        if not result:
+        url_id, original_url, is_active = cached
+        if not is_active:
             print(f"❌ URL not found for short_code: '{short_code}'")
             raise HTTPException(status_code=404, detail=f"Short URL '{short_code}' not found")
         
-        url_id, original_url = result
         print(f"✅ Found URL: {short_code} -> {original_url}")
         
         # クリック情報記録
@@ -46,6 +55,7 @@ async def redirect_url(short_code: str, request: Request, source: Optional[str]
             referrer = request.headers.get("referer", "")
             
             now = datetime.now()
+            created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
             hour_of_day = now.hour
             day_of_week = now.weekday()
             
@@ -76,31 +86,25 @@ async def redirect_url(short_code: str, request: Request, source: Optional[str]
             ua_info = parse_user_agent(user_agent)
             utm_info = parse_utm_parameters(referrer)
             
-            # クリック情報をデータベースに保存
-            cursor.execute('''
-                INSERT INTO clicks (
-                    url_id, ip_address, country, region, city, timezone,
-                    user_agent, referrer, device_type, browser, os, source,
-                    utm_source, utm_medium, utm_campaign,
-                    hour_of_day, day_of_week
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            # クリック情報を書き込みキューへ（永続化はバックグラウンドで一括実行）
+            queued = click_writer.submit((
                 url_id, client_ip, location_info['country'], 
                 location_info['region'], location_info['city'], location_info['timezone'],
                 user_agent, referrer, ua_info['device_type'],
                 ua_info['browser'], ua_info['os'], click_source,
                 utm_info.get('utm_source'), utm_info.get('utm_medium'), utm_info.get('utm_campaign'),
-                hour_of_day, day_of_week
+                created_at, hour_of_day, day_of_week
             ))
-            conn.commit()
             
-            print(f"✅ Click recorded: {short_code} (source: {click_source})")
+            if queued:
+                print(f"✅ Click queued: {short_code} (source: {click_source})")
+            else:
+                print(f"⚠️  Click queue full, dropped: {short_code}")
             
         except Exception as e:
             print(f"⚠️  Failed to record click: {e}")
             # クリック記録に失敗してもリダイレクトは続行
         
-        conn.close()
         return RedirectResponse(url=original_url, status_code=302)
         
     except HTTPException:
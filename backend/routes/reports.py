@@ -0,0 +1,89 @@
+from fastapi import APIRouter, HTTPException, Query
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+from config import PANDAS_AVAILABLE
+from cache import url_cache, analytics_cache
+from singleflight import analytics_flight
+from analytics_executor import analytics_executor
+from database import get_db_connection, run_db
+from reports import REPORT_PRESETS, ReportError, build_pivot, parse_dimensions
+from rollups import ALL_LINKS
+from .redirect import _lookup_url
+
+router = APIRouter()
+
+def _compute_report(rows: Tuple[str, ...], columns: Tuple[str, ...], short_code: Optional[str],
+                    campaign: Optional[str], start: Optional[date], end: Optional[date]) -> Dict[str, Any]:
+    """クロス集計レポートを作成（分析用プロセスで実行）"""
+    try:
+        with get_db_connection() as conn:
+            report = build_pivot(conn, rows, columns, short_code, campaign, start, end)
+    except ReportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Report failed: {str(e)}")
+
+    report["filters"] = {
+        "short_code": short_code,
+        "campaign": campaign,
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None
+    }
+    return report
+
+async def get_report(rows: Tuple[str, ...], columns: Tuple[str, ...], short_code: Optional[str],
+                     campaign: Optional[str], start: Optional[date], end: Optional[date]) -> Dict[str, Any]:
+    """レポートを分析キャッシュ経由で取得（キーは指定の組み合わせ）
+
+    リンク指定のレポートはそのリンクのクリック記録で、それ以外はTTLの経過で古い扱いになる。
+    """
+    if not PANDAS_AVAILABLE:
+        raise HTTPException(status_code=500, detail="Report generation not available")
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+
+    url_id = ALL_LINKS
+    if short_code:
+        cached = url_cache.get(short_code)
+        if cached is None:
+            cached = await run_db("redirect", _lookup_url, short_code)
+            url_cache.set(short_code, cached)
+        if not cached[2]:
+            raise HTTPException(status_code=404, detail="Short URL not found")
+        url_id = cached[0]
+
+    key = ('report', rows, columns, short_code, campaign, start, end)
+    return await analytics_cache.get_or_compute(
+        key, url_id,
+        lambda: analytics_flight.do(
+            key, lambda: analytics_executor.run(_compute_report, rows, columns, short_code, campaign, start, end)
+        )
+    )
+
+@router.get("/reports/pivot")
+async def get_pivot_report(rows: str = Query(..., description="行のディメンション（カンマ区切り）"),
+                           columns: str = Query('', description="列のディメンション（カンマ区切り）"),
+                           short_code: Optional[str] = None,
+                           campaign: Optional[str] = None,
+                           start: Optional[date] = None,
+                           end: Optional[date] = None):
+    """任意のディメンションでクリック数をクロス集計"""
+    try:
+        row_dimensions, column_dimensions = parse_dimensions(rows), parse_dimensions(columns)
+    except ReportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await get_report(row_dimensions, column_dimensions, short_code, campaign, start, end)
+
+@router.get("/reports/{report_name}")
+async def get_preset_report(report_name: str,
+                            short_code: Optional[str] = None,
+                            campaign: Optional[str] = None,
+                            start: Optional[date] = None,
+                            end: Optional[date] = None):
+    """定義済みレポート（source-device-day, campaign-country）"""
+    preset = REPORT_PRESETS.get(report_name)
+    if preset is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    rows, columns = preset
+    report = await get_report(rows, columns, short_code, campaign, start, end)
+    return {"report": report_name, **report}
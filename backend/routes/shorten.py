@@ -1,37 +1,51 @@
 from fastapi import APIRouter, HTTPException
 import sqlite3
+from typing import Tuple
 from models import URLCreate, URLResponse
-from config import DB_PATH, BASE_URL
+from config import BASE_URL
+from database import db_writer, run_db
+from cache import url_cache
 from utils import generate_short_code, generate_qr_code_base64
 
 router = APIRouter()
 
-@router.post("/api/shorten", response_model=URLResponse)
-async def shorten_url(url_data: URLCreate):
-    """URL短縮エンドポイント"""
+# 生成コードの衝突時の最大試行回数
+MAX_CODE_ATTEMPTS = 5
+
+def _insert_url(conn: sqlite3.Connection, url_data: URLCreate) -> Tuple[str, str]:
+    """URLを登録（ライタースレッドで実行）"""
+    cursor = conn.cursor()
+    
+    # カスタムスラッグの処理
+    if url_data.custom_slug:
+        cursor.execute("SELECT id FROM urls WHERE short_code = ?", (url_data.custom_slug,))
+        if cursor.fetchone():
+            raise HTTPException(status_code=400, detail="Custom slug already exists")
+    
+    # URLを保存（生成コードが旧方式のコード等と衝突した場合のみ次のコードで再試行）
+    for attempt in range(MAX_CODE_ATTEMPTS):
+        short_code = url_data.custom_slug or generate_short_code(conn=conn)
+        try:
+            cursor.execute('''
+                INSERT INTO urls (short_code, original_url, custom_name, campaign_name, created_by) 
+                VALUES (?, ?, ?, ?, ?)
+            ''', (short_code, url_data.original_url, url_data.custom_name, url_data.campaign_name, 'api'))
+            break
+        except sqlite3.IntegrityError:
+            if url_data.custom_slug or attempt == MAX_CODE_ATTEMPTS - 1:
+                raise
+    
+    # 作成時刻取得
+    cursor.execute("SELECT created_at FROM urls WHERE short_code = ?", (short_code,))
+    created_at = cursor.fetchone()[0]
+    
+    return short_code, created_at
+
+def _shorten_url(url_data: URLCreate):
+    """URL短縮処理（DB書き込みスレッドで実行）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # カスタムスラッグの処理
-        if url_data.custom_slug:
-            cursor.execute("SELECT id FROM urls WHERE short_code = ?", (url_data.custom_slug,))
-            if cursor.fetchone():
-                raise HTTPException(status_code=400, detail="Custom slug already exists")
-            short_code = url_data.custom_slug
-        else:
-            short_code = generate_short_code(conn=conn)
-        
-        # URLを保存
-        cursor.execute('''
-            INSERT INTO urls (short_code, original_url, custom_name, campaign_name, created_by) 
-            VALUES (?, ?, ?, ?, ?)
-        ''', (short_code, url_data.original_url, url_data.custom_name, url_data.campaign_name, 'api'))
-        conn.commit()
-        
-        # 作成時刻取得
-        cursor.execute("SELECT created_at FROM urls WHERE short_code = ?", (short_code,))
-        created_at = cursor.fetchone()[0]
+        short_code, created_at = db_writer.call(_insert_url, url_data)
+        url_cache.invalidate(short_code)
         
         # URL生成
         short_url = f"{BASE_URL}/{short_code}"
@@ -49,10 +63,14 @@ async def shorten_url(url_data: URLCreate):
             campaign_name=url_data.campaign_name
         )
         
-        conn.close()
         return response
         
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@router.post("/api/shorten", response_model=URLResponse)
+async def shorten_url(url_data: URLCreate):
+    """URL短縮エンドポイント"""
+    return await run_db("write", _shorten_url, url_data)
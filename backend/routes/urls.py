@@ -0,0 +1,112 @@
+from fastapi import APIRouter, HTTPException, Query
+import base64
+import binascii
+import json
+from typing import Any, Dict, Optional, Tuple
+from config import BASE_URL, URLS_INLINE_QR_MAX
+from database import get_db_connection, run_db
+from qr_cache import qr_cache
+
+router = APIRouter()
+
+def _encode_cursor(created_at: str, url_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, url_id]).encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        created_at, url_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(created_at), int(url_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+def _list_urls(limit: int, cursor: Optional[str], inline_qr: bool, qr_size: int) -> Dict[str, Any]:
+    """URL一覧を (created_at, id) の降順でページ単位に取得（分析用DBスレッドで実行）"""
+    with get_db_connection() as conn:
+        if cursor:
+            created_at, url_id = _decode_cursor(cursor)
+            rows = conn.execute('''
+                SELECT id, short_code, original_url, created_at, custom_name, campaign_name
+                FROM urls
+                WHERE is_active = 1 AND (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', (created_at, url_id, limit + 1)).fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT id, short_code, original_url, created_at, custom_name, campaign_name
+                FROM urls
+                WHERE is_active = 1
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', (limit + 1,)).fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        # クリック集計はこのページのURLだけを対象にする（書き込み時に更新される url_stats から）
+        click_stats = {}
+        if rows:
+            placeholders = ', '.join('?' for _ in rows)
+            for url_id, click_count, qr_clicks, unique_clicks in conn.execute(f'''
+                SELECT url_id, click_count, qr_count, unique_estimate
+                FROM url_stats
+                WHERE url_id IN ({placeholders})
+            ''', [row[0] for row in rows]):
+                click_stats[url_id] = (click_count, qr_clicks, unique_clicks)
+    
+    qr_images = {}
+    if inline_qr and rows:
+        entries = qr_cache.get_many([f"{BASE_URL}/{row[1]}?source=qr" for row in rows], qr_size)
+        qr_images = {
+            row[1]: base64.b64encode(entry[0]).decode('utf-8') if entry else None
+            for row, entry in zip(rows, entries)
+        }
+    
+    urls = []
+    for url_id, short_code, original_url, created_at, custom_name, campaign_name in rows:
+        click_count, qr_clicks, unique_clicks = click_stats.get(url_id, (0, 0, 0))
+        url = {
+            "short_code": short_code,
+            "original_url": original_url,
+            "created_at": created_at,
+            "custom_name": custom_name,
+            "campaign_name": campaign_name,
+            "click_count": click_count,
+            "qr_clicks": qr_clicks,
+            "unique_clicks": unique_clicks,
+            "other_clicks": click_count - qr_clicks,
+            "short_url": f"{BASE_URL}/{short_code}",
+            "qr_url": f"{BASE_URL}/{short_code}?source=qr",
+            "qr_image_url": f"{BASE_URL}/api/qr/{short_code}?size={qr_size}",
+            "analytics_url": f"{BASE_URL}/analytics/{short_code}"
+        }
+        if inline_qr:
+            url["qr_code_base64"] = qr_images.get(short_code)
+        urls.append(url)
+    
+    return {
+        "urls": urls,
+        "limit": limit,
+        "next_cursor": _encode_cursor(rows[-1][3], rows[-1][0]) if has_more else None
+    }
+
+@router.get("/urls")
+async def get_urls(limit: int = Query(50, ge=1, le=500),
+                   cursor: Optional[str] = None,
+                   inline_qr: bool = False,
+                   qr_size: int = Query(150, ge=50, le=1000)):
+    """URL一覧（カーソルでページング）
+
+    QRは各行の qr_image_url から取得する。inline_qr=true の場合のみ
+    base64画像を埋め込み、その場合は1ページあたりの件数を制限する。
+    """
+    if inline_qr and limit > URLS_INLINE_QR_MAX:
+        raise HTTPException(status_code=400, detail=f"inline_qr is limited to {URLS_INLINE_QR_MAX} URLs per page")
+    
+    try:
+        return await run_db("analytics", _list_urls, limit, cursor, inline_qr, qr_size)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error getting URLs: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
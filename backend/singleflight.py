@@ -0,0 +1,51 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class SingleFlight:
+    """同じキーの同時実行を1回にまとめる（イベントループのスレッドから使う）
+
+    実行中のキーに対する呼び出しは新たに計算せず、実行中のタスクの結果
+    （例外も含む）を共有する。計算はタスクとして実行するため、待っている
+    リクエストの1つが切断されても他のリクエストの計算は止まらない。
+    キーがタプルの場合は先頭要素ごとに件数を集計する。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self.executions: Dict[Any, int] = defaultdict(int)
+        self.coalesced: Dict[Any, int] = defaultdict(int)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        kind = key[0] if isinstance(key, tuple) else key
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.executions[kind] += 1
+        else:
+            self.coalesced[kind] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        executions = sum(self.executions.values())
+        coalesced = sum(self.coalesced.values())
+        calls = executions + coalesced
+        return {
+            "in_flight": len(self._inflight),
+            "executions": executions,
+            "coalesced": coalesced,
+            "coalesced_rate": round(coalesced / calls, 4) if calls else 0.0,
+            "by_kind": {
+                str(kind): {"executions": self.executions[kind], "coalesced": self.coalesced.get(kind, 0)}
+                for kind in self.executions
+            }
+        }
+
+    def _forget(self, key: Hashable, task: "asyncio.Future[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+# 重い分析クエリ用（キーは (種類, 対象)）
+analytics_flight = SingleFlight()
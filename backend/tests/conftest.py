@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# config は import 時に環境変数を読むため、アプリのモジュールより先に一時DBを指定する
+_tmp_dir = tempfile.mkdtemp(prefix="link-tracker-tests-")
+os.environ["DB_PATH"] = os.path.join(_tmp_dir, "test.db")
+os.environ["BASE_URL"] = "http://testserver"
+os.environ["CLICK_JOURNAL_DIR"] = os.path.join(_tmp_dir, "click_journal")
+os.environ["QR_CACHE_DB_PATH"] = os.path.join(_tmp_dir, "qr_cache.db")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,140 @@
+import itertools
+import random
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import columnar
+from config import DB_PATH
+from database import create_connection, init_db, get_db_connection
+from rollups import rebuild_rollups
+from routes import analytics_old
+
+SOURCES = [None, '', 'qr', 'direct']
+DEVICES = [None, '', 'mobile', 'desktop']
+COUNTRIES = [None, '', 'Unknown', 'JP', 'US']
+# 範囲外の値（261 や 257 は int8 に詰めると 5 / 1 に化ける）
+HOURS = [None, 0, 5, 23, 24, -3, 261]
+WEEKDAYS = [None, 0, 1, 6, 7, 257]
+
+def _window():
+    """直近30日の開始時刻を時間枠の途中（30分）に固定した recent_window"""
+    start = (datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=30)).replace(
+        minute=30, second=0, microsecond=0
+    )
+    next_bucket = start.replace(minute=0) + timedelta(hours=1)
+    return start, next_bucket
+
+@pytest.fixture(scope="module")
+def links():
+    """同数が並ぶリンクと、ランダムなリンクの2つを用意して集計表を構築"""
+    assert init_db()
+    start, _ = _window()
+    conn = sqlite3.connect(DB_PATH)
+    codes = {'tied': 'tiedlnk', 'mixed': 'mixedln'}
+    ids = {}
+    for name, code in codes.items():
+        ids[name] = conn.execute(
+            "INSERT INTO urls (short_code, original_url) VALUES (?, ?)", (code, f"https://example.com/{name}")
+        ).lastrowid
+
+    rows = []
+    # 全組み合わせを同じ件数ずつ（デバイス・参照元・国・日別トップがすべて同数になる）
+    for days_ago in (0, 3, 45):
+        at = (start + timedelta(days=30 - days_ago)).strftime('%Y-%m-%d %H:%M:%S')
+        for source, device, country in itertools.product(SOURCES, DEVICES, COUNTRIES):
+            rows.append((ids['tied'], source, device, country, 12, 3, at))
+
+    rng = random.Random(23)
+    for _ in range(3000):
+        at = start + timedelta(days=rng.uniform(-20, 30))
+        rows.append((ids['mixed'], rng.choice(SOURCES), rng.choice(DEVICES), rng.choice(COUNTRIES),
+                     rng.choice(HOURS), rng.choice(WEEKDAYS), at.strftime('%Y-%m-%d %H:%M:%S')))
+    # 30日境界の時間枠: 開始時刻より前の分は日別に含めず、後の分だけ含める
+    for minutes in (-20, -1, 0, 1, 20):
+        at = (start + timedelta(minutes=minutes)).strftime('%Y-%m-%d %H:%M:%S')
+        rows.append((ids['mixed'], 'qr', 'mobile', 'JP', start.hour, start.weekday(), at))
+
+    conn.executemany('''
+        INSERT INTO clicks (url_id, source, device_type, country, hour_of_day, day_of_week, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+    conn = create_connection(DB_PATH)
+    conn.isolation_level = None
+    conn.execute("BEGIN IMMEDIATE")
+    rebuild_rollups(conn)
+    conn.execute("COMMIT")
+    conn.close()
+    return codes, ids
+
+@pytest.fixture
+def fixed_window(monkeypatch):
+    start, next_bucket = _window()
+    window = (start.strftime('%Y-%m-%d %H:%M:%S'), next_bucket.strftime('%Y-%m-%d %H:%M:%S'))
+    monkeypatch.setattr(analytics_old, "recent_window", lambda days=30: window)
+    return window
+
+def _analytics(monkeypatch, short_code, min_rows):
+    monkeypatch.setattr(columnar, "ANALYTICS_COLUMNAR_MIN_ROWS", min_rows)
+    return analytics_old._compute_detailed_analytics(short_code)
+
+@pytest.mark.parametrize("name", ["tied", "mixed"])
+def test_columnar_matches_cube(monkeypatch, links, fixed_window, name):
+    codes, ids = links
+    with get_db_connection() as conn:
+        monkeypatch.setattr(columnar, "ANALYTICS_COLUMNAR_MIN_ROWS", 1)
+        assert columnar.aggregate_large_link(conn, ids[name], fixed_window[1]) is not None
+
+    cube = _analytics(monkeypatch, codes[name], 0)
+    vectorized = _analytics(monkeypatch, codes[name], 1)
+    assert vectorized == cube
+
+def test_matches_raw_clicks(monkeypatch, links, fixed_window):
+    """集計表経由の結果が生のclicksから直接数えた値と一致する"""
+    codes, ids = links
+    window_start, _ = fixed_window
+    result = _analytics(monkeypatch, codes['mixed'], 1)
+
+    conn = sqlite3.connect(DB_PATH)
+    url_id = ids['mixed']
+    assert result['total_clicks'] == conn.execute(
+        "SELECT COUNT(*) FROM clicks WHERE url_id = ?", (url_id,)).fetchone()[0]
+    daily = conn.execute('''
+        SELECT date(created_at), COUNT(*), COUNT(CASE WHEN source = 'qr' THEN 1 END)
+        FROM clicks WHERE url_id = ? AND created_at >= ?
+        GROUP BY 1 ORDER BY 1
+    ''', (url_id, window_start)).fetchall()
+    assert list(zip(result['daily_labels'], result['daily_clicks'], result['daily_qr_clicks'])) == daily
+
+    hourly = [0] * 24
+    for hour, count in conn.execute('''
+        SELECT hour_of_day, COUNT(*) FROM clicks
+        WHERE url_id = ? AND hour_of_day BETWEEN 0 AND 23 GROUP BY 1
+    ''', (url_id,)):
+        hourly[hour] = count
+    assert result['hourly_data'] == hourly
+    weekly = [0] * 7
+    for weekday, count in conn.execute('''
+        SELECT day_of_week, COUNT(*) FROM clicks
+        WHERE url_id = ? AND day_of_week BETWEEN 0 AND 6 GROUP BY 1
+    ''', (url_id,)):
+        weekly[weekday] = count
+    assert result['weekly_data'] == weekly
+
+    assert 'Unknown' not in result['geo_labels'] and None not in result['geo_labels']
+    conn.close()
+
+def test_tied_counts_follow_sql_order(monkeypatch, links, fixed_window):
+    """同数はNULL（空文字も集計表ではNULL）が先頭、以降は値の昇順"""
+    codes, _ = links
+    result = _analytics(monkeypatch, codes['tied'], 1)
+    assert result['device_labels'] == [None, 'desktop', 'mobile']
+    assert result['source_labels'] == [None, 'direct', 'qr']
+    assert result['geo_labels'] == ['JP', 'US']
+    assert {(d['top_device'], d['top_source']) for d in result['daily_details']} == {(None, None)}
@@ -1,49 +1,34 @@
 import string
 import random
 import base64
-from io import BytesIO
 from datetime import datetime
 from typing import Dict, Any, Optional  # Optionalを追加
-from config import QR_AVAILABLE, UA_AVAILABLE
+from config import UA_AVAILABLE
+from code_allocator import code_allocator
+from qr_cache import qr_cache
 
-def generate_short_code(length: int = 6, conn=None) -> str:
+def generate_short_code(length: Optional[int] = None, conn=None) -> str:
+    """短縮コードを生成
 
-    """短縮コードを生成"""
+    connを渡した場合はカウンタ＋置換による割り当て（重複なし・存在確認不要）。
+    書き込みトランザクション内で呼ぶこと。長さは SHORT_CODE_LENGTH で決まるため
+    length とは併用できない。
+    """
+    if conn:
+        if length is not None:
+            raise ValueError("length cannot be used with conn (the allocator uses SHORT_CODE_LENGTH)")
+        return code_allocator.allocate(conn)[0]
+    
     characters = string.ascii_letters + string.digits
-    while True:
-        code = ''.join(random.choice(characters) for _ in range(length))
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM urls WHERE short_code = ?", (code,))
-            if not cursor.fetchone():
-                return code
-        else:
-            return code
+    return ''.join(random.choice(characters) for _ in range(length or 6))
 
 def generate_qr_code_base64(url: str, size: int = 200) -> Optional[str]:
-    """QRコードをBase64で生成"""
-    if not QR_AVAILABLE:
-        return None
-    
+    """QRコードをBase64で生成（描画結果はqr_cacheで共有）"""
     try:
-        import qrcode
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        qr_image = qr_image.resize((size, size))
-        
-        img_buffer = BytesIO()
-        qr_image.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
-        return base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+        entry = qr_cache.get(url, size)
+        if entry is None:
+            return None
+        return base64.b64encode(entry[0]).decode('utf-8')
     except Exception:
         return None
 